@@ -5,21 +5,53 @@
 
 描述：
 此脚本用于将多个SEGY文件合并为一个新的SEGY文件：
-1. 使用内存映射方式读取SEGY文件
-2. 批量读取和处理道数据
+1. 使用内存映射方式读取SEGY文件，多个输入文件并行写入输出文件的不同区域
+2. 批量复制道数据的原始字节，不经过解码和重新编码
 3. 保持原始文件的采样率、格式等参数
 4. 正确合并所有道数据和头信息
 5. 只保留必要的header属性
-6. 使用numpy向量化操作优化header写入速度
+6. 使用numpy结构化数组映射输入和输出文件的道头区域，按批次向量化读写header
 
 输出：
 - 合并后的新SEGY文件
 - 处理进度信息
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from segy_utils import TRACE_DATA_OFFSET, trace_dtype, trace_memmap, release_page_cache
+
+# 需要保留的道头字段
+HEADER_FIELDS = ['trace_number', 'sample_count', 'sample_interval', 'group_x', 'group_y', 'source_x', 'source_y']
+
+def copy_file_traces(filename, new_traces, dst_start, batch_size, pbar):
+    """
+    将一个输入文件的全部道复制到输出文件的[dst_start, dst_start + 道数)区域
+    
+    参数：
+    filename: str, 输入SEGY文件路径
+    new_traces: np.memmap, 输出文件的全部道记录
+    dst_start: int, 该文件第一道在输出文件中的道号
+    batch_size: int, 每批次处理的道数
+    pbar: tqdm, 共享的进度条
+    """
+    with segyio.open(filename, "r", ignore_geometry=True) as segy:
+        src_traces = trace_memmap(filename, segy, HEADER_FIELDS, sequential=True)
+        num_traces = segy.tracecount
+        for start in range(0, num_traces, batch_size):
+            end = min(start + batch_size, num_traces)
+            dst = new_traces[dst_start + start:dst_start + end]
+            # 格式已验证一致, 直接复制道数据的原始字节, 不做解码和编码
+            dst['data'] = src_traces['data'][start:end]
+            # 从输入文件的道头区域批量读取, 直接写入输出文件的道头区域
+            for name in HEADER_FIELDS:
+                dst[name] = src_traces[name][start:end]
+            pbar.update(end - start)
+        del src_traces
+    release_page_cache(filename)
 
 def merge_segy_files(input_files, output_file, batch_size=100000):
     """
@@ -34,6 +66,7 @@ def merge_segy_files(input_files, output_file, batch_size=100000):
     # 首先统计总道数和验证文件兼容性
     total_traces = 0
     first_file = None
+    dst_starts = []
     
     print("检查文件兼容性...")
     for filename in input_files:
@@ -50,6 +83,7 @@ def merge_segy_files(input_files, output_file, batch_size=100000):
                     str(segy.format) != str(first_file['format'])):
                     raise ValueError(f"文件 {filename} 与第一个文件的格式不兼容")
             
+            dst_starts.append(total_traces)
             total_traces += segy.tracecount
             
     print(f"\n总道数: {total_traces}")
@@ -67,51 +101,18 @@ def merge_segy_files(input_files, output_file, batch_size=100000):
         with segyio.open(input_files[0], "r", ignore_geometry=True) as first_segy:
             new_segy.text[0] = first_segy.text[0]
             new_segy.bin = first_segy.bin
-        current_trace = 0
-        # 处理每个输入文件
-        for filename in input_files:
-            with segyio.open(filename, "r", ignore_geometry=True) as segy:
-                if segy.mmap():
-                    print(f"文件 {filename} 已成功进行内存映射")
-                else:
-                    print(f"文件 {filename} 内存映射失败！")
-                num_traces = segy.tracecount
-                num_batches = (num_traces + batch_size - 1) // batch_size
-                print(f"\n处理文件: {filename}")
-                for batch in tqdm(range(num_batches), desc="合并道数据"):
-                    start = batch * batch_size
-                    end = min((batch + 1) * batch_size, num_traces)
-                    batch_size_current = end - start
-                    # 批量读写道数据
-                    traces = segy.trace[start:end]
-                    new_segy.trace[current_trace:current_trace + batch_size_current] = traces
-                    # 批量读取道头
-                    headers = np.zeros(batch_size_current, dtype=np.dtype([
-                        ('trace_number', 'i4'), 
-                        ('sample_count', 'i4'), ('sample_interval', 'i4'),
-                        ('group_x', 'i4'),      ('group_y', 'i4'),
-                        ('source_x', 'i4'),     ('source_y', 'i4')
-                    ]))
-                    headers['trace_number'] = segy.attributes(segyio.TraceField.TraceNumber)[start:end]
-                    headers['sample_count'] = segy.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[start:end]
-                    headers['sample_interval'] = segy.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[start:end]
-                    headers['group_x'] = segy.attributes(segyio.TraceField.GroupX)[start:end]
-                    headers['group_y'] = segy.attributes(segyio.TraceField.GroupY)[start:end]
-                    headers['source_x'] = segy.attributes(segyio.TraceField.SourceX)[start:end]
-                    headers['source_y'] = segy.attributes(segyio.TraceField.SourceY)[start:end]
-                    # 逐道写入道头
-                    for i in range(batch_size_current):
-                        trace_index = current_trace + i
-                        new_segy.header[trace_index].update({
-                            segyio.TraceField.TraceNumber: headers[i]['trace_number'],
-                            segyio.TraceField.TRACE_SAMPLE_COUNT: headers[i]['sample_count'],
-                            segyio.TraceField.TRACE_SAMPLE_INTERVAL: headers[i]['sample_interval'],
-                            segyio.TraceField.GroupX: headers[i]['group_x'],
-                            segyio.TraceField.GroupY: headers[i]['group_y'],
-                            segyio.TraceField.SourceX: headers[i]['source_x'],
-                            segyio.TraceField.SourceY: headers[i]['source_y']
-                        })
-                    current_trace += batch_size_current
+        # 将输出文件的全部道记录映射为结构化数组, 道头按批次整体写入
+        new_traces = np.memmap(output_file, mode="r+", offset=TRACE_DATA_OFFSET, shape=(total_traces,),
+                               dtype=trace_dtype(first_file['samples'].size, first_file['format'], HEADER_FIELDS))
+        # 各输入文件写入输出文件中互不重叠的区域, 使用线程池并行复制
+        with tqdm(total=total_traces, desc="合并道数据") as pbar:
+            with ThreadPoolExecutor(max_workers=min(len(input_files), os.cpu_count() or 1)) as executor:
+                futures = [executor.submit(copy_file_traces, filename, new_traces, dst_start, batch_size, pbar)
+                           for filename, dst_start in zip(input_files, dst_starts)]
+                for future in futures:
+                    future.result()
+        new_traces.flush()
+        del new_traces
                         
     print(f"\n合并完成！新文件已保存为: {output_file}")
     print(f"总道数: {total_traces}")
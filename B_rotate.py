@@ -9,22 +9,35 @@
 1. 使用内存映射方式读取SEGY文件
 2. 从center_file计算旋转参数
 3. 对filename中的坐标进行旋转变换
-4. 使用numpy向量化操作进行坐标转换
-5. 优化文件写入操作
+4. 使用numba编译的并行内核一次遍历完成坐标转换
+5. 通过结构化内存映射整批写入道头和道数据
 
 输出：
 - 包含旋转后坐标的新SEGY文件
 - 处理进度信息
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm
 import matplotlib.pyplot as plt
-
-def calculate_rotation_params(center_file, batch_size=100000):
-    """从参考文件计算旋转参数"""
-    print("从参考文件计算旋转参数...")
+from numba import njit, prange
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, release_page_cache, unique_xy, plot_points
+
+@njit(['void(i4[::1], i4[::1], f8, f8, f8, f8, f8[::1], f8[::1])',
+       'void(f8[::1], f8[::1], f8, f8, f8, f8, f8[::1], f8[::1])'],
+      parallel=True, fastmath=True, boundscheck=False, cache=True)
+def rotate_xy(x, y, center_x, center_y, cos_a, sin_a, out_x, out_y):
+    """绕中心点旋转坐标, 结果写入out_x, out_y"""
+    for i in prange(x.shape[0]):
+        dx = x[i] - center_x
+        dy = y[i] - center_y
+        out_x[i] = cos_a * dx - sin_a * dy + center_x
+        out_y[i] = sin_a * dx + cos_a * dy + center_y
+
+def read_group_coords(center_file, batch_size=100000):
+    """从参考文件读取所有检波点坐标"""
     with segyio.open(center_file, "r", ignore_geometry=True) as center:
         if center.mmap():
             print(f"参考文件 {center_file} 已成功进行内存映射")
@@ -32,33 +45,53 @@ def calculate_rotation_params(center_file, batch_size=100000):
             print(f"参考文件 {center_file} 内存映射失败！")
         
         num_traces = center.tracecount
-        x_all = np.zeros(num_traces)
-        y_all = np.zeros(num_traces)
+        center_traces = trace_memmap(center_file, center, KEPT_FIELDS, sequential=True)
+        x_all = np.empty(num_traces, dtype=np.int32)
+        y_all = np.empty(num_traces, dtype=np.int32)
         
         # 分批读取所有坐标
         for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取参考文件坐标"):
             batch_end = min(batch_start + batch_size, num_traces)
-            x_all[batch_start:batch_end] = center.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-            y_all[batch_start:batch_end] = center.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
-        # 对检波点坐标进行去重, 计算中心点, 并中心化坐标
-        unique_coords = np.unique(np.column_stack((x_all, y_all)), axis=0)
-        group_centerX = np.mean(unique_coords[:, 0])
-        group_centerY = np.mean(unique_coords[:, 1])
-        x_centered = unique_coords[:, 0] - group_centerX
-        y_centered = unique_coords[:, 1] - group_centerY
-        # 计算协方差矩阵, 计算旋转角度, 并构造旋转矩阵
-        coords = np.vstack((x_centered, y_centered))
-        cov_matrix = coords @ coords.T / len(unique_coords)
-        _, eigenvectors = np.linalg.eig(cov_matrix)
-        principal_vector = eigenvectors[:, 0]
-        angle = np.arctan2(principal_vector[1], principal_vector[0])
-        rotation_matrix = np.array([
-            [np.cos(-angle), -np.sin(-angle)],
-            [np.sin(-angle),  np.cos(-angle)]
-        ])
-        # 输出计算出来的旋转角度
-        print(f"计算得到的旋转角度: {np.degrees(angle)} 度")
-        return group_centerX, group_centerY, rotation_matrix
+            x_all[batch_start:batch_end] = center_traces['group_x'][batch_start:batch_end]
+            y_all[batch_start:batch_end] = center_traces['group_y'][batch_start:batch_end]
+        del center_traces
+        return x_all, y_all
+
+def calculate_rotation_params(center_file, batch_size=100000, group_coords=None):
+    """
+    从参考文件计算旋转参数
+    group_coords: 已读取的参考文件检波点坐标(x_all, y_all), 提供时不再重复读取参考文件
+    """
+    print("从参考文件计算旋转参数...")
+    if group_coords is None:
+        x_all, y_all = read_group_coords(center_file, batch_size)
+    else:
+        x_all, y_all = group_coords
+    # 对检波点坐标进行去重, 计算中心点, 并中心化坐标
+    unique_coords = unique_xy(x_all, y_all)
+    group_centerX = np.mean(unique_coords[:, 0])
+    group_centerY = np.mean(unique_coords[:, 1])
+    x_centered = unique_coords[:, 0] - group_centerX
+    y_centered = unique_coords[:, 1] - group_centerY
+    # 计算协方差矩阵, 计算旋转角度, 并构造旋转矩阵
+    sxx = np.dot(x_centered, x_centered)
+    sxy = np.dot(x_centered, y_centered)
+    syy = np.dot(y_centered, y_centered)
+    cov_matrix = np.array([[sxx, sxy], [sxy, syy]]) / len(unique_coords)
+    # 协方差矩阵对称, 使用eigh; 特征值升序排列, 最后一列为主方向
+    _, eigenvectors = np.linalg.eigh(cov_matrix)
+    principal_vector = eigenvectors[:, -1]
+    # 特征向量符号不确定, 统一指向x正半轴, 使旋转角度落在(-90, 90]度内
+    if principal_vector[0] < 0:
+        principal_vector = -principal_vector
+    angle = np.arctan2(principal_vector[1], principal_vector[0])
+    rotation_matrix = np.array([
+        [np.cos(-angle), -np.sin(-angle)],
+        [np.sin(-angle),  np.cos(-angle)]
+    ])
+    # 输出计算出来的旋转角度
+    print(f"计算得到的旋转角度: {np.degrees(angle)} 度")
+    return group_centerX, group_centerY, rotation_matrix
 
 def plot_rotation_result(groupX, groupY, sourceX, sourceY, 
                         final_groupX, final_groupY, final_sourceX, final_sourceY,
@@ -67,17 +100,15 @@ def plot_rotation_result(groupX, groupY, sourceX, sourceY,
     绘制旋转前后的对比图，使用去重后的坐标点进行绘制
     """
     # 去重处理
-    unique_orig_coords = np.unique(np.column_stack((groupX, groupY)), axis=0)
-    unique_orig_source = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
-    unique_final_coords = np.unique(np.column_stack((final_groupX, final_groupY)), axis=0)
-    unique_final_source = np.unique(np.column_stack((final_sourceX, final_sourceY)), axis=0)
+    unique_orig_coords = unique_xy(groupX, groupY)
+    unique_orig_source = unique_xy(sourceX, sourceY)
+    unique_final_coords = unique_xy(final_groupX, final_groupY)
+    unique_final_source = unique_xy(final_sourceX, final_sourceY)
     
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
     
-    # 绘制旋转前的坐标（使用去重后的数据）
-    ax1.scatter(unique_orig_coords[:, 0], unique_orig_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_orig_coords)})', 
-               alpha=0.5, s=10)
+    # 绘制旋转前的坐标（使用去重后的数据）, 检波点始终以二维直方图栅格绘制
+    plot_points(ax1, unique_orig_coords, 'blue', 'Blues', label=f'Receivers ({len(unique_orig_coords)})', max_points=0)
     ax1.scatter(unique_orig_source[:, 0], unique_orig_source[:, 1], 
                color='green', label=f'Sources ({len(unique_orig_source)})', 
                alpha=0.8, s=20)
@@ -88,9 +119,7 @@ def plot_rotation_result(groupX, groupY, sourceX, sourceY,
     ax1.grid(True)
     
     # 绘制旋转后的坐标（使用去重后的数据）
-    ax2.scatter(unique_final_coords[:, 0], unique_final_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_final_coords)})', 
-               alpha=0.5, s=10)
+    plot_points(ax2, unique_final_coords, 'blue', 'Blues', label=f'Receivers ({len(unique_final_coords)})', max_points=0)
     ax2.scatter(unique_final_source[:, 0], unique_final_source[:, 1], 
                color='green', label=f'Sources ({len(unique_final_source)})', 
                alpha=0.8, s=20)
@@ -115,9 +144,6 @@ def plot_rotation_result(groupX, groupY, sourceX, sourceY,
     print(f"旋转对比图已保存为: {output_path}")
 
 def process_segy(filename, new_filename, center_file, batch_size=100000):
-    # 从参考文件计算旋转参数
-    group_centerX, group_centerY, rotation_matrix = calculate_rotation_params(center_file, batch_size)
-
     # 打开需要旋转的SEGY文件
     with segyio.open(filename, "r", ignore_geometry=True) as segyfile:
         if segyfile.mmap():
@@ -126,32 +152,39 @@ def process_segy(filename, new_filename, center_file, batch_size=100000):
             print(f"\n文件 {filename} 内存映射失败！")
 
         num_traces = segyfile.tracecount
+        traces = trace_memmap(filename, segyfile, KEPT_FIELDS, sequential=True)
         
-        # 读取需要旋转的文件的坐标
-        groupX = np.zeros(num_traces)
-        groupY = np.zeros(num_traces)
-        sourceX = np.zeros(num_traces)
-        sourceY = np.zeros(num_traces)
+        # 读取需要旋转的文件的坐标(道头坐标为int32)
+        groupX = np.empty(num_traces, dtype=np.int32)
+        groupY = np.empty(num_traces, dtype=np.int32)
+        sourceX = np.empty(num_traces, dtype=np.int32)
+        sourceY = np.empty(num_traces, dtype=np.int32)
         
         for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取待旋转文件坐标"):
             batch_end = min(batch_start + batch_size, num_traces)
-            groupX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-            groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
-            sourceX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceX)[batch_start:batch_end]
-            sourceY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceY)[batch_start:batch_end]
+            groupX[batch_start:batch_end] = traces['group_x'][batch_start:batch_end]
+            groupY[batch_start:batch_end] = traces['group_y'][batch_start:batch_end]
+            sourceX[batch_start:batch_end] = traces['source_x'][batch_start:batch_end]
+            sourceY[batch_start:batch_end] = traces['source_y'][batch_start:batch_end]
+
+        # 从参考文件计算旋转参数; 参考文件即待旋转文件时直接复用已读取的检波点坐标
+        if os.path.samefile(filename, center_file):
+            group_centerX, group_centerY, rotation_matrix = calculate_rotation_params(
+                center_file, batch_size, group_coords=(groupX, groupY))
+        else:
+            group_centerX, group_centerY, rotation_matrix = calculate_rotation_params(center_file, batch_size)
 
-        # 向量化处理所有坐标
+        # 旋转所有坐标
+        cos_a, sin_a = rotation_matrix[0, 0], rotation_matrix[1, 0]
         # 检波点
-        group_coords = np.vstack((groupX - group_centerX, groupY - group_centerY)).T
-        rotated_group = group_coords @ rotation_matrix.T
-        final_groupX = rotated_group[:, 0] + group_centerX
-        final_groupY = rotated_group[:, 1] + group_centerY
+        final_groupX = np.empty(num_traces)
+        final_groupY = np.empty(num_traces)
+        rotate_xy(groupX, groupY, group_centerX, group_centerY, cos_a, sin_a, final_groupX, final_groupY)
 
         # 炮点
-        source_coords = np.vstack((sourceX - group_centerX, sourceY - group_centerY)).T
-        rotated_source = source_coords @ rotation_matrix.T
-        final_sourceX = rotated_source[:, 0] + group_centerX
-        final_sourceY = rotated_source[:, 1] + group_centerY
+        final_sourceX = np.empty(num_traces)
+        final_sourceY = np.empty(num_traces)
+        rotate_xy(sourceX, sourceY, group_centerX, group_centerY, cos_a, sin_a, final_sourceX, final_sourceY)
 
         # 在计算完旋转坐标后，添加绘图调用
         plot_rotation_result(
@@ -166,49 +199,38 @@ def process_segy(filename, new_filename, center_file, batch_size=100000):
         spec.sorting = segyfile.sorting
         spec.tracecount = num_traces
 
-        # 创建新文件并写入数据
+        # 创建新文件并写入文本头和二进制头
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
 
-            # 分批处理
-            for batch_start in tqdm(range(0, num_traces, batch_size), desc="处理数据"):
-                batch_end = min(batch_start + batch_size, num_traces)
-                batch_size_current = batch_end - batch_start
-
-                # 批量写入道数据
-                new_segy.trace.raw[batch_start:batch_end] = segyfile.trace.raw[batch_start:batch_end]
-
-                # 批量处理header属性
-                headers = np.zeros(batch_size_current, dtype=np.dtype([
-                    ('source_depth', 'i4'),
-                    ('trace_number', 'i4'), 
-                    ('sample_count', 'i4'),
-                    ('sample_interval', 'i4')
-                ]))
-                
-                # 使用numpy向量化操作填充header数组
-                headers['source_depth'] = segyfile.attributes(segyio.TraceField.SourceDepth)[batch_start:batch_end]
-                headers['trace_number'] = segyfile.attributes(segyio.TraceField.TraceNumber)[batch_start:batch_end]
-                headers['sample_count'] = segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_start:batch_end]
-                headers['sample_interval'] = segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_start:batch_end]
-
-                # 逐道写入header
-                for i in range(batch_size_current):
-                    trace_index = batch_start + i
-                    header = headers[i]
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: header['source_depth'],
-                        segyio.TraceField.TraceNumber: header['trace_number'],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: header['sample_count'],
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: header['sample_interval'],
-                        segyio.TraceField.GroupX: int(final_groupX[trace_index]),
-                        segyio.TraceField.GroupY: int(final_groupY[trace_index]),
-                        segyio.TraceField.SourceX: int(final_sourceX[trace_index]),
-                        segyio.TraceField.SourceY: int(final_sourceY[trace_index])
-                    })
+        # 将输出文件的道记录映射为结构化数组, 道头和道数据按批次整块写入
+        new_traces = np.memmap(new_filename, mode="r+", offset=TRACE_DATA_OFFSET, shape=(num_traces,),
+                               dtype=traces.dtype)
+
+        # 分批处理
+        for batch_start in tqdm(range(0, num_traces, batch_size), desc="处理数据"):
+            batch_end = min(batch_start + batch_size, num_traces)
+            new_batch = new_traces[batch_start:batch_end]
+
+            # 批量写入道数据, 直接复制原始字节
+            new_batch['data'] = traces['data'][batch_start:batch_end]
+
+            # 批量写入不变的header属性, 其余道头字节保持为零
+            for name in ('source_depth', 'trace_number', 'sample_count', 'sample_interval'):
+                new_batch[name] = traces[name][batch_start:batch_end]
+
+            # 旋转后的坐标整批转换为int32(向零截断, 与原先的int()一致)后写入
+            new_batch['group_x'] = final_groupX[batch_start:batch_end].astype(np.int32)
+            new_batch['group_y'] = final_groupY[batch_start:batch_end].astype(np.int32)
+            new_batch['source_x'] = final_sourceX[batch_start:batch_end].astype(np.int32)
+            new_batch['source_y'] = final_sourceY[batch_start:batch_end].astype(np.int32)
 
+        new_traces.flush()
+        del new_traces
+        del traces
         print(f"\n新的SEGY文件已保存为 {new_filename}")
+    release_page_cache(filename)
 
 if __name__ == "__main__":
     filename = "../result_0118/A_merge.SEGY"
@@ -13,19 +13,65 @@ import numpy as np
 from tqdm import tqdm
 import os
 import matplotlib.pyplot as plt
+from numba import njit, prange, types, get_num_threads
+from numba.typed import Dict, List
+from segy_utils import trace_memmap, release_page_cache, pack_xy, unpack_xy
+
+# 用到的道头字段
+HEADER_FIELDS = ['source_x', 'source_y']
+
+@njit(cache=True)
+def group_by_partition(keys, num_partitions):
+    """
+    按键的哈希分区对一个批次的炮点键做计数排序, 返回重排后的键和各分区的起止位置,
+    第p个分区的键为grouped[bounds[p]:bounds[p + 1]]
+    """
+    partition_ids = np.empty(keys.shape[0], dtype=np.int64)
+    bounds = np.zeros(num_partitions + 1, dtype=np.int64)
+    for i in range(keys.shape[0]):
+        key = keys[i]
+        p = (key ^ (key >> 32)) % num_partitions
+        partition_ids[i] = p
+        bounds[p + 1] += 1
+    for p in range(num_partitions):
+        bounds[p + 1] += bounds[p]
+    grouped = np.empty_like(keys)
+    positions = bounds[:-1].copy()
+    for i in range(keys.shape[0]):
+        p = partition_ids[i]
+        grouped[positions[p]] = keys[i]
+        positions[p] += 1
+    return grouped, bounds
+
+@njit(parallel=True, cache=True)
+def accumulate_counts(partitions, keys):
+    """
+    将一个批次的炮点键并行计数到分区字典中
+    先按哈希分区对键分组, 每个线程只遍历落在自己分区的那一段键, 各分区字典互不相交, 无需加锁也无需合并
+    """
+    num_partitions = len(partitions)
+    grouped, bounds = group_by_partition(keys, num_partitions)
+    for p in prange(num_partitions):
+        shot_counts = partitions[np.int64(p)]
+        for i in range(bounds[p], bounds[p + 1]):
+            key = grouped[i]
+            shot_counts[key] = shot_counts.get(key, 0) + 1
 
 def scan_unfull_shots(filenames, receiver_count_filter, batch_size=100000):
     """
     输入:
         filenames: SEGY文件路径列表
-        receiver_count_filter: 检波点数过滤函数,输入为count,返回True表示异常
+        receiver_count_filter: 检波点数过滤函数,输入为count数组,返回True表示异常
         batch_size: 批处理大小
     描述:
         使用批处理和内存映射统计每个炮点的检波点数
     输出:
         异常炮点坐标数组
     """
-    shot_receiver_count = {}
+    # 跨批次共享的 炮点键 -> 检波点数 计数字典, 按线程数分区
+    shot_count_dicts = List()
+    for _ in range(get_num_threads()):
+        shot_count_dicts.append(Dict.empty(key_type=types.int64, value_type=types.int64))
     
     # 统计每个炮点的检波点数
     for filename in filenames:
@@ -39,36 +85,43 @@ def scan_unfull_shots(filenames, receiver_count_filter, batch_size=100000):
             print(f"总道数: {num_traces}")
             
             num_batches = (num_traces + batch_size - 1) // batch_size
+            traces = trace_memmap(filename, segyfile, HEADER_FIELDS, with_data=False, sequential=True)
             
             for batch in tqdm(range(num_batches), desc="统计检波点数"):
                 start = batch * batch_size
                 end = min((batch + 1) * batch_size, num_traces)
                 
-                # 批量读取炮点坐标
-                sourceX = np.array(segyfile.attributes(segyio.TraceField.SourceX)[start:end])
-                sourceY = np.array(segyfile.attributes(segyio.TraceField.SourceY)[start:end])
+                # 从映射中直接读取这个批次的炮点坐标(道头坐标为int32)
+                sourceX = traces['source_x'][start:end].astype(np.int32)
+                sourceY = traces['source_y'][start:end].astype(np.int32)
                 
-                # 统计每个炮点的检波点数
-                for i in range(len(sourceX)):
-                    shot_key = (sourceX[i], sourceY[i])
-                    shot_receiver_count[shot_key] = shot_receiver_count.get(shot_key, 0) + 1
+                # 统计这个批次内每个炮点的检波点数
+                accumulate_counts(shot_count_dicts, pack_xy(sourceX, sourceY))
+            del traces
+        release_page_cache(filename)
+    
+    # 取出统计结果并按炮点键排序
+    shot_keys = np.concatenate([np.fromiter(d.keys(), dtype=np.int64, count=len(d)) for d in shot_count_dicts])
+    shot_counts = np.concatenate([np.fromiter(d.values(), dtype=np.int64, count=len(d)) for d in shot_count_dicts])
+    order = np.argsort(shot_keys)
+    shot_keys, shot_counts = shot_keys[order], shot_counts[order]
+    shot_coords = unpack_xy(shot_keys)
     
     # 找出检波点数不满足条件的炮点
-    bad_shots = [(x, y) for (x, y), count in shot_receiver_count.items() 
-                   if receiver_count_filter(count)]
+    bad_mask = np.asarray(receiver_count_filter(shot_counts), dtype=bool)
+    bad_shots = shot_coords[bad_mask]
     
     # 同时输出每个异常炮点的实际检波点数，便于分析
     print("\n异常炮点统计:")
-    for x, y in bad_shots:
-        print(f"炮点({x}, {y}) 的检波点数: {shot_receiver_count[(x, y)]}")
+    for (x, y), count in zip(bad_shots, shot_counts[bad_mask]):
+        print(f"炮点({x}, {y}) 的检波点数: {count}")
     
     # 打印共发现多少炮点数
-    print(f"共发现 {len(shot_receiver_count)} 个炮点")
+    print(f"共发现 {len(shot_keys)} 个炮点")
     
     # 绘制检波点数量分布直方图
-    counts = list(shot_receiver_count.values())
     plt.figure(figsize=(10, 6))
-    plt.hist(counts, bins=50, edgecolor='black')
+    plt.hist(shot_counts, bins=50, edgecolor='black')
     plt.title('shots-receivers count')
     plt.xlabel('receivers count')
     plt.ylabel('shots count')
@@ -77,7 +130,7 @@ def scan_unfull_shots(filenames, receiver_count_filter, batch_size=100000):
     plt.close()
     print(f"检波点数量分布直方图已保存至: ../fig_0118/receiver_count_histogram.png")
     
-    return np.array(bad_shots)
+    return bad_shots
 
 def save_unfull_shots(bad_shots, output_file):
     """
@@ -2,9 +2,9 @@
 此脚本用于处理 SEGY 格式的炮集数据或三维速度模型，允许用户根据自定义的过滤函数删除含特定炮点的地震道。
 
 主要步骤：
-1. 读取原始SEGY文件中的炮点坐标。
-2. 应用过滤函数，识别出需要保留的炮点。
-3. 创建一个新的SEGY文件，只包含经过过滤后的炮点数据。
+1. 按批次顺序读取原始SEGY文件中的炮点坐标。
+2. 对每个批次应用过滤函数，识别出需要保留的炮点。
+3. 将保留的道立即追加写入新的SEGY文件，只包含经过过滤后的炮点数据；内存占用与文件道数无关。
 
 函数：
 - delete_sources_by_coordinates: 根据提供的过滤函数，处理和保存新的SEGY文件。
@@ -15,34 +15,43 @@
 - filter_function: lambda过滤函数，用于确定哪些炮点需要被删除。
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm  # 导入进度条库
 import matplotlib.pyplot as plt
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, release_page_cache, pack_xy, unpack_xy, plot_points
 
-def plot_filter_result(groupX, groupY, sourceX, sourceY, 
-                      keep_indices, output_path):
+def add_unique_keys(key_set, x, y):
     """
-    绘制过滤前后的观测系统对比图，使用去重后的坐标点进行绘制
+    将一个批次的坐标对加入键集合key_set = [已去重的int64键数组, 待合并的各批次去重键列表],
+    待合并的键累积到与已有键相当时再合并, 避免每个批次都重新排序全部已有键
     """
-    # 去重处理原始坐标
-    unique_orig_coords = np.unique(np.column_stack((groupX, groupY)), axis=0)
-    unique_orig_source = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
-    
-    # 获取过滤后的坐标并去重
-    filtered_sourceX = sourceX[keep_indices]
-    filtered_sourceY = sourceY[keep_indices]
-    filtered_groupX = groupX[keep_indices]
-    filtered_groupY = groupY[keep_indices]
-    unique_filtered_coords = np.unique(np.column_stack((filtered_groupX, filtered_groupY)), axis=0)
-    unique_filtered_source = np.unique(np.column_stack((filtered_sourceX, filtered_sourceY)), axis=0)
+    unique_keys, pending_keys = key_set
+    pending_keys.append(np.unique(pack_xy(x, y)))
+    if sum(len(keys) for keys in pending_keys) >= len(unique_keys):
+        key_set[0] = np.unique(np.concatenate([unique_keys] + pending_keys))
+        pending_keys.clear()
+
+def merged_unique_keys(key_set):
+    """合并键集合中剩余的待合并键, 返回去重并排序后的int64键数组"""
+    unique_keys, pending_keys = key_set
+    return np.unique(np.concatenate([unique_keys] + pending_keys))
+
+def plot_filter_result(receiver_keys, source_keys, filtered_receiver_keys, filtered_source_keys,
+                      output_path):
+    """
+    绘制过滤前后的观测系统对比图，使用去重后的坐标点(int64键)进行绘制
+    """
+    unique_orig_coords = unpack_xy(receiver_keys)
+    unique_orig_source = unpack_xy(source_keys)
+    unique_filtered_coords = unpack_xy(filtered_receiver_keys)
+    unique_filtered_source = unpack_xy(filtered_source_keys)
     
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
     
-    # 绘制过滤前的坐标
-    ax1.scatter(unique_orig_coords[:, 0], unique_orig_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_orig_coords)})', 
-               alpha=0.5, s=10)
+    # 绘制过滤前的坐标, 检波点始终以二维直方图栅格绘制
+    plot_points(ax1, unique_orig_coords, 'blue', 'Blues', label=f'Receivers ({len(unique_orig_coords)})', max_points=0)
     ax1.scatter(unique_orig_source[:, 0], unique_orig_source[:, 1], 
                color='green', label=f'Sources ({len(unique_orig_source)})', 
                alpha=0.8, s=20)
@@ -53,9 +62,7 @@ def plot_filter_result(groupX, groupY, sourceX, sourceY,
     ax1.grid(True)
     
     # 绘制过滤后的坐标
-    ax2.scatter(unique_filtered_coords[:, 0], unique_filtered_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_filtered_coords)})', 
-               alpha=0.5, s=10)
+    plot_points(ax2, unique_filtered_coords, 'blue', 'Blues', label=f'Receivers ({len(unique_filtered_coords)})', max_points=0)
     ax2.scatter(unique_filtered_source[:, 0], unique_filtered_source[:, 1], 
                color='green', label=f'Sources ({len(unique_filtered_source)})', 
                alpha=0.8, s=20)
@@ -90,82 +97,75 @@ def delete_sources_by_coordinates(filename, new_filename, filter_function, batch
         spec.samples = segyfile.samples
         spec.format = segyfile.format
         spec.sorting = segyfile.sorting
+        spec.tracecount = 1
 
-        # 初始化数组存储所有坐标
-        num_traces = segyfile.tracecount
-        sourceX_all = np.zeros(num_traces)
-        sourceY_all = np.zeros(num_traces)
-        groupX_all = np.zeros(num_traces)
-        groupY_all = np.zeros(num_traces)
-        keep_indices = []
-        
-        # 分批读取所有坐标
-        num_batches = (num_traces + batch_size - 1) // batch_size
-        for batch in tqdm(range(num_batches), desc="读取和处理坐标"):
-            start = batch * batch_size
-            end = min((batch + 1) * batch_size, num_traces)
-
-            # 读取这个批次的坐标
-            sourceX = segyfile.attributes(segyio.TraceField.SourceX)[start:end]
-            sourceY = segyfile.attributes(segyio.TraceField.SourceY)[start:end]
-            groupX = segyfile.attributes(segyio.TraceField.GroupX)[start:end]
-            groupY = segyfile.attributes(segyio.TraceField.GroupY)[start:end]
-            
-            # 存储坐标
-            sourceX_all[start:end] = sourceX
-            sourceY_all[start:end] = sourceY
-            groupX_all[start:end] = groupX
-            groupY_all[start:end] = groupY
-
-            # 使用numpy的向量化操作来加速过滤
-            filter_results = filter_function(sourceX, sourceY)
-            keep_indices.extend(np.where(~filter_results)[0] + start)
-
-        spec.tracecount = len(keep_indices)
-        
-        # 绘制过滤前后的对比图
-        plot_filter_result(groupX_all, groupY_all, sourceX_all, sourceY_all, 
-                         keep_indices, "../fig_0118/C_vel_shot_filter_result.png")
-
-        # 创建新的SEGY文件并写入数据
+        # 创建新的SEGY文件并写入文本头和二进制头, 道记录随后按批次追加
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
 
-            # 批量处理
-            for batch_start in tqdm(range(0, len(keep_indices), batch_size), desc="写入数据"):
-                batch_end = min(batch_start + batch_size, len(keep_indices))
-                batch_indices = keep_indices[batch_start:batch_end]
-                
-                # 批量读取这个批次的header属性
-                batch_headers = {
-                    'source_depth': segyfile.attributes(segyio.TraceField.SourceDepth)[batch_indices],
-                    'trace_number': segyfile.attributes(segyio.TraceField.TraceNumber)[batch_indices],
-                    'sample_count': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_indices],
-                    'sample_interval': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_indices]
-                }
-                
-                # 一次性更新这个批次的所有header
-                for i in range(len(batch_indices)):
-                    trace_index = batch_start + i
-                    orig_index = batch_indices[i]
-                    
-                    # 读取并写入道数据
-                    new_segy.trace.raw[trace_index] = segyfile.trace.raw[orig_index]
-                    
-                    # 写入header
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: batch_headers['source_depth'][i],
-                        segyio.TraceField.TraceNumber: batch_headers['trace_number'][i],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: batch_headers['sample_count'][i],
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: batch_headers['sample_interval'][i],
-                        segyio.TraceField.GroupX: int(groupX_all[orig_index]),
-                        segyio.TraceField.GroupY: int(groupY_all[orig_index]),
-                        segyio.TraceField.SourceX: int(sourceX_all[orig_index]),
-                        segyio.TraceField.SourceY: int(sourceY_all[orig_index])
-                    })
+        # segyio不允许创建0道文件, 截掉占位道, 只保留文本头和二进制头
+        os.truncate(new_filename, TRACE_DATA_OFFSET)
+
+        # 将输入文件的道记录映射为结构化数组
+        num_traces = segyfile.tracecount
+        traces = trace_memmap(filename, segyfile, KEPT_FIELDS, sequential=True)
+        num_kept = 0
+
+        # 过滤前后去重后的检波点和炮点(int64键), 只用于绘图
+        receiver_keys, source_keys, filtered_receiver_keys, filtered_source_keys = (
+            [np.empty(0, dtype=np.int64), []] for _ in range(4))
+        
+        # 单次顺序遍历: 每个批次读取坐标、过滤, 并立即追加写入保留的道
+        with open(new_filename, "ab") as new_file:
+            for start in tqdm(range(0, num_traces, batch_size), desc="过滤并写入数据"):
+                end = min(start + batch_size, num_traces)
+                batch = traces[start:end]
+
+                # 读取这个批次的坐标(道头坐标为int32)
+                sourceX = batch['source_x'].astype(np.int32)
+                sourceY = batch['source_y'].astype(np.int32)
+                groupX = batch['group_x'].astype(np.int32)
+                groupY = batch['group_y'].astype(np.int32)
+
+                # 使用numpy的向量化操作来加速过滤
+                keep_mask = ~np.asarray(filter_function(sourceX, sourceY), dtype=bool)
+
+                add_unique_keys(receiver_keys, groupX, groupY)
+                add_unique_keys(source_keys, sourceX, sourceY)
+                add_unique_keys(filtered_receiver_keys, groupX[keep_mask], groupY[keep_mask])
+                add_unique_keys(filtered_source_keys, sourceX[keep_mask], sourceY[keep_mask])
+
+                # 保留的道记录从映射中一次性整条取出, 其余字段都从这份副本中读取
+                kept = batch[keep_mask]
+
+                # 只保留需要的header属性, 其余道头字节置零, 道数据按原始字节复制
+                new_batch = np.zeros(len(kept), dtype=traces.dtype)
+                new_batch['data'] = kept['data']
+                for name in ('source_depth', 'trace_number', 'sample_count', 'sample_interval'):
+                    new_batch[name] = kept[name]
+                # 坐标在过滤时已经读出, 直接复用
+                new_batch['group_x'] = groupX[keep_mask]
+                new_batch['group_y'] = groupY[keep_mask]
+                new_batch['source_x'] = sourceX[keep_mask]
+                new_batch['source_y'] = sourceY[keep_mask]
+                new_batch.tofile(new_file)
+                num_kept += len(new_batch)
+
+        del traces
+        print(f"保留道数: {num_kept} / {num_traces}")
+        if num_kept == 0:
+            # 不留下只有文件头的输出文件
+            os.remove(new_filename)
+            raise ValueError(f"过滤后没有保留任何道, 未生成 {new_filename}")
+        
+        # 绘制过滤前后的对比图
+        plot_filter_result(*(merged_unique_keys(key_set) for key_set in
+                             (receiver_keys, source_keys, filtered_receiver_keys, filtered_source_keys)),
+                         "../fig_0118/C_vel_shot_filter_result.png")
 
         print(f"新的 SEGY 文件已保存为 {new_filename}")
+    release_page_cache(filename)
 
 filename = "../result_0118/B_vel_rotate.segy"
 new_filename = "../result_0118/C_vel_shot_filter_new.segy"
@@ -178,12 +178,12 @@ filter_function1 = lambda x, y: (x < xmin) | (x > xmax) | (y < ymin) | (y > ymax
 
 # # 加载需要去除的炮点坐标
 # unfull_shots = np.load("../result_0118/not_4096_shots.npy")
-# # 创建一个复数数组来表示坐标对，这样可以一次性比较
-# unfull_complex = unfull_shots[:, 0] + 1j * unfull_shots[:, 1]
-# filter_function2 = lambda x, y: np.in1d(x + 1j * y, unfull_complex)
+# # 将坐标对打包为int64键，这样可以一次性精确比较
+# unfull_keys = pack_xy(unfull_shots[:, 0], unfull_shots[:, 1])
+# filter_function2 = lambda x, y: np.isin(pack_xy(x, y), unfull_keys)
 
-# # 定义新的过滤函数，使用复数进行向量化比较并同时满足function1和function2的条件
-# filter_function_combined = lambda x, y: ((x < xmin) | (x > xmax) | (y < ymin) | (y > ymax)) | np.in1d(x + 1j * y, unfull_complex)
+# # 定义新的过滤函数，使用int64键进行向量化比较并同时满足function1和function2的条件
+# filter_function_combined = lambda x, y: ((x < xmin) | (x > xmax) | (y < ymin) | (y > ymax)) | np.isin(pack_xy(x, y), unfull_keys)
 
 # valid_y = np.array([3931644, 3931744, 3931844, 3931944, 3932044, 3932144, 3932244, 3932344, 3932444, 3932544, 3932644, 3932744, 3932844, 3932944, 3933044, 3933144, 3933244, 3933344, 3933444, 3933544, 3933644, 3933744, 3933844, 3933944, 3934044, 3934144, 3934244, 3934344, 3934444, 3934544, 3934644, 3934744, 3934844, 3934944, 3935044, 3935144, 3935244, 3935344, 3935444, 3935544, 3935644, 3935744, 3935844, 3935944, 3936044, 3936144, 3936244, 3936344, 3936444, 3936544, 3936644, 3936744, 3936844, 3936944, 3937044, 3937144])
 # filter_function3 = lambda x, y: ~np.isin(y, valid_y)
@@ -16,27 +16,31 @@
 - 过滤前后的观测系统对比图
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm
 import matplotlib.pyplot as plt
+from numba import njit, prange
+from concurrent.futures import ThreadPoolExecutor
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, unique_xy, thin_points, plot_points
 
 def plot_filter_result(groupX, groupY, sourceX, sourceY, 
-                      keep_indices, boundary, output_path):
+                      keep_mask, boundary, output_path):
     """
     绘制过滤前后的观测系统对比图，使用去重后的坐标点进行绘制
     """
     # 去重处理原始坐标
-    unique_orig_coords = np.unique(np.column_stack((groupX, groupY)), axis=0)
-    unique_orig_source = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
+    unique_orig_coords = unique_xy(groupX, groupY)
+    unique_orig_source = unique_xy(sourceX, sourceY)
     
     # 获取过滤后的坐标并去重
-    filtered_groupX = groupX[keep_indices]
-    filtered_groupY = groupY[keep_indices]
-    filtered_sourceX = sourceX[keep_indices]
-    filtered_sourceY = sourceY[keep_indices]
-    unique_filtered_coords = np.unique(np.column_stack((filtered_groupX, filtered_groupY)), axis=0)
-    unique_filtered_source = np.unique(np.column_stack((filtered_sourceX, filtered_sourceY)), axis=0)
+    filtered_groupX = groupX[keep_mask]
+    filtered_groupY = groupY[keep_mask]
+    filtered_sourceX = sourceX[keep_mask]
+    filtered_sourceY = sourceY[keep_mask]
+    unique_filtered_coords = unique_xy(filtered_groupX, filtered_groupY)
+    unique_filtered_source = unique_xy(filtered_sourceX, filtered_sourceY)
     
     print(f"\n原始检波点数量: {len(groupX)} -> 去重后: {len(unique_orig_coords)}")
     print(f"原始炮点数量: {len(sourceX)} -> 去重后: {len(unique_orig_source)}")
@@ -46,12 +50,11 @@ def plot_filter_result(groupX, groupY, sourceX, sourceY,
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
     
     # 绘制过滤前的坐标
-    ax1.scatter(unique_orig_coords[:, 0], unique_orig_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_orig_coords)})', 
-               alpha=0.5, s=10)
-    ax1.scatter(unique_orig_source[:, 0], unique_orig_source[:, 1], 
+    plot_points(ax1, unique_orig_coords, 'blue', 'Blues',
+                label=f'Receivers ({len(unique_orig_coords)})')
+    ax1.scatter(*thin_points(unique_orig_source), 
                color='green', label=f'Sources ({len(unique_orig_source)})', 
-               alpha=0.8, s=20)
+               alpha=0.8, s=20, rasterized=True)
     # 绘制边界框
     ax1.plot([boundary[0], boundary[1], boundary[1], boundary[0], boundary[0]],
              [boundary[2], boundary[2], boundary[3], boundary[3], boundary[2]],
@@ -63,12 +66,11 @@ def plot_filter_result(groupX, groupY, sourceX, sourceY,
     ax1.grid(True)
     
     # 绘制过滤后的坐标
-    ax2.scatter(unique_filtered_coords[:, 0], unique_filtered_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_filtered_coords)})', 
-               alpha=0.5, s=10)
-    ax2.scatter(unique_filtered_source[:, 0], unique_filtered_source[:, 1], 
+    plot_points(ax2, unique_filtered_coords, 'blue', 'Blues',
+                label=f'Receivers ({len(unique_filtered_coords)})')
+    ax2.scatter(*thin_points(unique_filtered_source), 
                color='green', label=f'Sources ({len(unique_filtered_source)})', 
-               alpha=0.8, s=20)
+               alpha=0.8, s=20, rasterized=True)
     # 绘制边界框
     ax2.plot([boundary[0], boundary[1], boundary[1], boundary[0], boundary[0]],
              [boundary[2], boundary[2], boundary[3], boundary[3], boundary[2]],
@@ -93,6 +95,29 @@ def plot_filter_result(groupX, groupY, sourceX, sourceY,
     
     print(f"过滤对比图已保存为: {output_path}")
 
+def copy_kept_traces(traces, new_traces, keep_mask, batch_start, batch_end, new_start, pbar):
+    """将输入道[batch_start, batch_end)中保留的道复制到输出文件从new_start开始的区域"""
+    batch_mask = keep_mask[batch_start:batch_end]
+    # 整批都保留时直接从映射切片复制, 省去一次整条道记录的临时拷贝
+    kept = traces[batch_start:batch_end] if batch_mask.all() else traces[batch_start:batch_end][batch_mask]
+    new_batch = new_traces[new_start:new_start + len(kept)]
+
+    # 道数据按原始字节复制, 只保留需要的header属性, 其余道头字节保持为零
+    new_batch['data'] = kept['data']
+    for name in KEPT_FIELDS:
+        new_batch[name] = kept[name]
+    pbar.update(batch_end - batch_start)
+
+@njit(parallel=True, cache=True)
+def boundary_and_mask(sourceX, sourceY, groupX, groupY):
+    """计算炮点坐标的矩形边界, 并在同一次遍历中标记位于边界内的检波点"""
+    xmin, xmax = sourceX.min(), sourceX.max()
+    ymin, ymax = sourceY.min(), sourceY.max()
+    keep_mask = np.empty(groupX.shape[0], dtype=np.bool_)
+    for i in prange(groupX.shape[0]):
+        keep_mask[i] = (groupX[i] >= xmin) & (groupX[i] <= xmax) & (groupY[i] >= ymin) & (groupY[i] <= ymax)
+    return xmin, xmax, ymin, ymax, keep_mask
+
 def filter_receivers_by_source_boundary(filename, new_filename, batch_size=100000):
     with segyio.open(filename, "r", ignore_geometry=True) as segyfile:
         if segyfile.mmap():
@@ -105,79 +130,50 @@ def filter_receivers_by_source_boundary(filename, new_filename, batch_size=10000
         spec.format = segyfile.format
         spec.sorting = segyfile.sorting
 
-        # 初始化数组存储所有坐标
-        num_traces = segyfile.tracecount
-        sourceX_all = np.zeros(num_traces)
-        sourceY_all = np.zeros(num_traces)
-        groupX_all = np.zeros(num_traces)
-        groupY_all = np.zeros(num_traces)
-        
-        # 分批读取所有坐标
-        for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
-            batch_end = min(batch_start + batch_size, num_traces)
-            sourceX_all[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceX)[batch_start:batch_end]
-            sourceY_all[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceY)[batch_start:batch_end]
-            groupX_all[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-            groupY_all[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
-
-        # 计算炮点坐标的边界
-        xmin, xmax = np.min(sourceX_all), np.max(sourceX_all)
-        ymin, ymax = np.min(sourceY_all), np.max(sourceY_all)
+        # 将道记录映射为结构化数组, 每个坐标字段一次性读出(道头坐标为int32)
+        traces = trace_memmap(filename, segyfile, KEPT_FIELDS, sequential=True)
+        sourceX_all = traces['source_x'].astype(np.int32)
+        sourceY_all = traces['source_y'].astype(np.int32)
+        groupX_all = traces['group_x'].astype(np.int32)
+        groupY_all = traces['group_y'].astype(np.int32)
+
+        # 一次遍历计算炮点坐标的边界, 并找出边界内的检波点
+        xmin, xmax, ymin, ymax, keep_mask = boundary_and_mask(sourceX_all, sourceY_all, groupX_all, groupY_all)
         boundary = [xmin, xmax, ymin, ymax]
         print(f"\n炮点坐标边界:")
         print(f"X范围: {xmin} - {xmax}")
         print(f"Y范围: {ymin} - {ymax}")
+        num_kept = int(np.count_nonzero(keep_mask))
 
-        # 找出边界内的检波点
-        keep_indices = np.where(
-            (groupX_all >= xmin) & (groupX_all <= xmax) &
-            (groupY_all >= ymin) & (groupY_all <= ymax)
-        )[0]
-
-        spec.tracecount = len(keep_indices)
+        spec.tracecount = num_kept
         
         # 绘制过滤前后的对比图
         plot_filter_result(groupX_all, groupY_all, sourceX_all, sourceY_all, 
-                         keep_indices, boundary, "../fig_0118/D_receiver_filter_result.png")
+                         keep_mask, boundary, "../fig_0118/D_receiver_filter_result.png")
 
-        # 创建新的SEGY文件并写入数据
+        # 创建新的SEGY文件并写入文本头和二进制头
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
 
-            # 批量处理
-            for batch_start in tqdm(range(0, len(keep_indices), batch_size), desc="写入数据"):
-                batch_end = min(batch_start + batch_size, len(keep_indices))
-                batch_indices = keep_indices[batch_start:batch_end]
-                
-                # 批量读取这个批次的header属性
-                batch_headers = {
-                    'source_depth': segyfile.attributes(segyio.TraceField.SourceDepth)[batch_indices],
-                    'trace_number': segyfile.attributes(segyio.TraceField.TraceNumber)[batch_indices],
-                    'sample_count': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_indices],
-                    'sample_interval': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_indices]
-                }
-                
-                # 一次性更新这个批次的所有header
-                for i in range(len(batch_indices)):
-                    trace_index = batch_start + i
-                    orig_index = batch_indices[i]
-                    
-                    # 读取并写入道数据
-                    new_segy.trace.raw[trace_index] = segyfile.trace.raw[orig_index]
-                    
-                    # 写入header
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: batch_headers['source_depth'][i],
-                        segyio.TraceField.TraceNumber: batch_headers['trace_number'][i],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: batch_headers['sample_count'][i],
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: batch_headers['sample_interval'][i],
-                        segyio.TraceField.GroupX: int(groupX_all[orig_index]),
-                        segyio.TraceField.GroupY: int(groupY_all[orig_index]),
-                        segyio.TraceField.SourceX: int(sourceX_all[orig_index]),
-                        segyio.TraceField.SourceY: int(sourceY_all[orig_index])
-                    })
+        # 输出文件的道记录也映射为结构化数组, 道头和道数据按批次整块复制
+        new_traces = np.memmap(new_filename, mode="r+", offset=TRACE_DATA_OFFSET, shape=(num_kept,),
+                               dtype=traces.dtype)
+
+        # 按输入顺序分批, 每批保留的道写入输出文件中互不重叠的区域, 使用线程池并行复制
+        batch_starts = np.arange(0, len(keep_mask), batch_size)
+        batch_counts = np.add.reduceat(keep_mask, batch_starts, dtype=np.int64)
+        new_starts = np.cumsum(batch_counts) - batch_counts
+        with tqdm(total=len(keep_mask), desc="写入数据") as pbar:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                futures = [executor.submit(copy_kept_traces, traces, new_traces, keep_mask,
+                                           batch_start, min(batch_start + batch_size, len(keep_mask)), new_start, pbar)
+                           for batch_start, new_start in zip(batch_starts, new_starts)]
+                for future in futures:
+                    future.result()
 
+        new_traces.flush()
+        del new_traces, traces
         print(f"\n新的SEGY文件已保存为 {new_filename}")
 
 if __name__ == "__main__":
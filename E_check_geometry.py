@@ -23,17 +23,36 @@
 
 import segyio
 import numpy as np
-from tqdm import tqdm
+import pandas as pd
 import matplotlib.pyplot as plt
+from tqdm import tqdm
 import os
+from segy_utils import pack_xy, unpack_xy, plot_points
+
+def unique_rows_2d(a):
+    """
+    对(N, 2)坐标数组按行去重, 结果与np.unique(a, axis=0)相同(按x、y字典序排列)
+    将每行视为一个定长字节串做一维去重, 避免按行去重的慢速路径
+    """
+    a = np.ascontiguousarray(a)
+    rows = a.view(np.dtype((np.void, a.dtype.itemsize * a.shape[1]))).ravel()
+    _, index = np.unique(rows, return_index=True)
+    unique_a = a[index]
+    return unique_a[np.lexsort(unique_a.T[::-1])]
+
+def unique_int_xy(x, y):
+    """
+    对整数坐标对去重, 结果与unique_rows_2d相同(按x、y字典序排列)
+    打包为int64键后用哈希表去重, 不对全部道排序, 只对去重后的少量点排序
+    """
+    return unpack_xy(np.sort(pd.unique(pack_xy(x, y))))
 
 def plot_receiver_grid(unique_coords, x_diffs, y_diffs, output_path):
     """绘制检波点网格分布图"""
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 8))
     
     # 绘制检波点分布
-    ax1.scatter(unique_coords[:, 0], unique_coords[:, 1], 
-               color='blue', alpha=0.5, s=10)
+    plot_points(ax1, unique_coords, 'blue', 'Blues')
     ax1.set_title("Receiver Positions")
     ax1.set_xlabel('X Coordinate')
     ax1.set_ylabel('Y Coordinate')
@@ -79,21 +98,39 @@ def check_geometry(filename, output_coords_path, output_fig_path, batch_size=100
             num_traces = segyfile.tracecount
             print(f"总道数: {num_traces}")
             
-            # 分批读取所有检波点坐标
-            groupX = np.zeros(num_traces)
-            groupY = np.zeros(num_traces)
-            
+            # 分批读取坐标并去重, 只保留去重后的int64键, 内存占用随检波点数而非道数增长
+            print("\n进行坐标去重...")
+            gx_attr = segyfile.attributes(segyio.TraceField.GroupX)
+            gy_attr = segyfile.attributes(segyio.TraceField.GroupY)
+            unique_keys = np.empty(0, dtype=np.int64)
+            pending_keys = []
+            pending_size = 0
             for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
                 batch_end = min(batch_start + batch_size, num_traces)
-                groupX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-                groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
+                batch_keys = pd.unique(pack_xy(gx_attr[batch_start:batch_end], gy_attr[batch_start:batch_end]))
+                pending_keys.append(batch_keys)
+                pending_size += len(batch_keys)
+                # 待合并的键累积到与已有键相当时再合并, 避免每批都重新拷贝全部已有键
+                if pending_size >= max(len(unique_keys), batch_size):
+                    unique_keys = pd.unique(np.concatenate([unique_keys] + pending_keys))
+                    pending_keys = []
+                    pending_size = 0
+            unique_keys = pd.unique(np.concatenate([unique_keys] + pending_keys))
+            unique_coords = unpack_xy(np.sort(unique_keys))
+            num_points = num_traces
     else:
         raise ValueError(f"不支持的文件格式: {file_ext}")
 
-    # 对坐标进行去重
-    print("\n进行坐标去重...")
-    unique_coords = np.unique(np.column_stack((groupX, groupY)), axis=0)
-    print(f"检波点数量: {len(groupX)} -> 去重后: {len(unique_coords)}")
+    if file_ext == '.npy':
+        # 对坐标进行去重
+        print("\n进行坐标去重...")
+        if np.issubdtype(groupX.dtype, np.integer) and np.issubdtype(groupY.dtype, np.integer):
+            # 坐标为整数, 用哈希去重
+            unique_coords = unique_int_xy(groupX, groupY)
+        else:
+            unique_coords = unique_rows_2d(np.column_stack((groupX, groupY)))
+        num_points = len(groupX)
+    print(f"检波点数量: {num_points} -> 去重后: {len(unique_coords)}")
     
     # 导出去重后的检波点坐标
     np.save(output_coords_path, unique_coords)
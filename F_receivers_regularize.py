@@ -23,15 +23,14 @@
 import numpy as np
 import matplotlib.pyplot as plt
 from tqdm import tqdm
-from scipy.spatial import cKDTree
+from segy_utils import plot_points
 
 def plot_regularization_result(orig_coords, reg_coords, output_path):
     """绘制规则化前后的对比图"""
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
     
     # 绘制原始坐标
-    ax1.scatter(orig_coords[:, 0], orig_coords[:, 1], 
-               color='blue', alpha=0.5, s=10)
+    plot_points(ax1, orig_coords, 'blue', 'Blues')
     ax1.set_title(f"Original Receivers\n({len(orig_coords)} points)")
     ax1.set_xlabel('X Coordinate')
     ax1.set_ylabel('Y Coordinate')
@@ -39,8 +38,7 @@ def plot_regularization_result(orig_coords, reg_coords, output_path):
     ax1.set_aspect('equal')
 
     # 绘制规则化后的坐标
-    ax2.scatter(reg_coords[:, 0], reg_coords[:, 1], 
-               color='red', alpha=0.5, s=10)
+    plot_points(ax2, reg_coords, 'red', 'Reds')
     ax2.set_title(f"Regularized Receivers\n({len(reg_coords)} points)")
     ax2.set_xlabel('X Coordinate')
     ax2.set_ylabel('Y Coordinate')
@@ -101,9 +99,11 @@ def regularize_coordinates(coords_file, row_spacing, col_spacing, output_coords_
     if not np.all(reg_coords == reg_coords.astype(np.int32)):
         raise ValueError("存在非整数坐标！")
     
-    # 使用KD树找到每个原始点最近的网格点
-    tree = cKDTree(reg_coords)
-    distances, _ = tree.query(orig_coords)
+    # 规则网格上最近的网格点可直接由 (坐标 - 起点) / 间距 取整得到, 超出网格范围的点取边缘行列
+    col_index = np.clip(np.round((orig_coords[:, 0] - start_x) / col_spacing), 0, cols - 1)
+    row_index = np.clip(np.round((orig_coords[:, 1] - start_y) / row_spacing), 0, rows - 1)
+    distances = np.hypot(orig_coords[:, 0] - (start_x + col_index * col_spacing),
+                         orig_coords[:, 1] - (start_y + row_index * row_spacing))
     
     print(f"\n映射统计:")
     print(f"最大映射距离: {np.max(distances):.2f}")
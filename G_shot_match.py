@@ -4,7 +4,7 @@
 主要步骤：
 1. 读取规则化的网格点坐标
 2. 读取SEGY文件中的炮点和检波点坐标
-3. 按照从右下到左上的顺序匹配炮点到网格点
+3. 按照从右下到左上的顺序匹配炮点到网格点(KD树查找候选网格点)
 4. 对超出距离阈值的炮点进行舍弃
 5. 创建新的SEGY文件保存结果
 
@@ -20,21 +20,25 @@
 - 匹配统计信息
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm
-from scipy.spatial.distance import cdist
+from scipy.spatial import cKDTree
+from numba import njit
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, pack_xy, unique_xy, thin_points
 
 def plot_match_result(orig_shots, matched_shots, grid_points, output_path):
     """绘制匹配前后的对比图"""
     fig, (ax1, ax2) = plt.subplots(2, 1, figsize=(20, 20))
     
     # 绘制原始炮点
-    ax1.scatter(grid_points[:, 0], grid_points[:, 1], 
-               color='gray', alpha=0.3, s=10, label='Grid Points')
-    ax1.scatter(orig_shots[:, 0], orig_shots[:, 1], 
-               color='red', alpha=0.8, s=10, label='Original Shots')
+    ax1.scatter(*thin_points(grid_points), 
+               color='gray', alpha=0.3, s=10, label='Grid Points', rasterized=True)
+    ax1.scatter(*thin_points(orig_shots), 
+               color='red', alpha=0.8, s=10, label='Original Shots', rasterized=True)
     ax1.set_title(f"Original Shots\n({len(orig_shots)} points)")
     ax1.set_xlabel('X Coordinate')
     ax1.set_ylabel('Y Coordinate')
@@ -43,10 +47,10 @@ def plot_match_result(orig_shots, matched_shots, grid_points, output_path):
     ax1.set_aspect('equal')
 
     # 绘制匹配后的炮点
-    ax2.scatter(grid_points[:, 0], grid_points[:, 1], 
-               color='gray', alpha=0.3, s=10, label='Grid Points')
-    ax2.scatter(matched_shots[:, 0], matched_shots[:, 1], 
-               color='red', alpha=0.8, s=5, label='Matched Shots')
+    ax2.scatter(*thin_points(grid_points), 
+               color='gray', alpha=0.3, s=10, label='Grid Points', rasterized=True)
+    ax2.scatter(*thin_points(matched_shots), 
+               color='red', alpha=0.8, s=5, label='Matched Shots', rasterized=True)
     ax2.set_title(f"Matched Shots\n({len(matched_shots)} points)")
     ax2.set_xlabel('X Coordinate')
     ax2.set_ylabel('Y Coordinate')
@@ -62,41 +66,85 @@ def plot_match_result(orig_shots, matched_shots, grid_points, output_path):
     print(f"匹配结果对比图已保存为: {output_path}")
 
 def sort_shots_from_right_bottom_to_left_top(shot_points):
-    """从右下到左上排序炮点"""
-    indices = np.lexsort((-shot_points[:, 0], -shot_points[:, 1]))
-    return shot_points[indices]
+    """
+    从右下到左上排序炮点(先按-y, 再按-x)
+    炮点坐标为整数道头值, 两个排序键打包为一个int64键后只需一次argsort
+    """
+    # 以(-y, -x)打包, 键的顺序即为先按-y、再按-x的字典序
+    key = pack_xy(-shot_points[:, 1].astype(np.int64), -shot_points[:, 0].astype(np.int64))
+    return shot_points[np.argsort(key, kind='stable')]
+
+@njit(cache=True)
+def greedy_match(cand_grid, bounds, num_grid):
+    """
+    贪心匹配内核: 第i个炮点的候选网格点为cand_grid[bounds[i]:bounds[i + 1]](已按距离排序),
+    依次取第一个未被占用的网格点, 返回每个炮点匹配到的网格点序号, 未匹配为-1
+    """
+    num_shots = bounds.shape[0] - 1
+    matched_index = np.full(num_shots, -1, dtype=np.int64)
+    taken = np.zeros(num_grid, dtype=np.bool_)
+    for i in range(num_shots):
+        for k in range(bounds[i], bounds[i + 1]):
+            j = cand_grid[k]
+            if not taken[j]:
+                taken[j] = True
+                matched_index[i] = j
+                break
+    return matched_index
 
 def match_shots_to_grid(shot_points, grid_points, max_distance):
     """
     将炮点匹配到网格点上，超出距离阈值的炮点将被舍弃
-    返回匹配字典和匹配后的炮点坐标数组
+    返回两个逐行对应的数组: 匹配成功的原始炮点坐标, 及其匹配到的网格点坐标
     """
     # 从右下到左上排序炮点
     sorted_shots = sort_shots_from_right_bottom_to_left_top(shot_points)
     
-    # 初始化匹配结果
-    shot_to_grid = {}
-    matched_grid = np.zeros(len(grid_points), dtype=bool)
-    matched_shots = []
+    # 炮点与网格点各建一棵KD树做双树查询, 直接得到阈值范围内全部(炮点, 网格点)候选对的数组,
+    # 不再为每个炮点生成一个Python列表
+    pairs = cKDTree(sorted_shots).sparse_distance_matrix(cKDTree(grid_points), max_distance * (1 + 1e-9),
+                                                         output_type='ndarray')
+    cand_shot = pairs['i'].astype(np.int64)
+    cand_grid = pairs['j'].astype(np.int64)
     
-    # 对每个炮点进行匹配
-    for shot in sorted_shots:
-        # 计算到所有未匹配网格点的距离
-        distances = cdist([shot], grid_points[~matched_grid], 'euclidean')
-        
-        # 如果存在未匹配的网格点且最小距离在阈值内
-        if len(distances[0]) > 0 and np.min(distances) <= max_distance:
-            # 找到最近的未匹配网格点
-            closest_index = np.argmin(distances)
-            global_index = np.where(~matched_grid)[0][closest_index]
-            
-            # 记录匹配结果
-            shot_tuple = tuple(shot)
-            shot_to_grid[shot_tuple] = grid_points[global_index]
-            matched_grid[global_index] = True
-            matched_shots.append(grid_points[global_index])
+    # 与逐点计算欧氏距离的结果一致, 并按阈值精确筛选
+    diff = grid_points[cand_grid] - sorted_shots[cand_shot]
+    cand_dist = np.sqrt(diff[:, 0] ** 2 + diff[:, 1] ** 2)
+    within = cand_dist <= max_distance
+    cand_shot, cand_grid, cand_dist = cand_shot[within], cand_grid[within], cand_dist[within]
+    
+    # 候选按 炮点顺序 -> 距离 -> 网格点序号 排序, 距离相同时取序号小的网格点
+    order = np.lexsort((cand_grid, cand_dist, cand_shot))
+    cand_shot, cand_grid = cand_shot[order], cand_grid[order]
+    bounds = np.searchsorted(cand_shot, np.arange(len(sorted_shots) + 1))
+    
+    # 按顺序贪心匹配: 每个炮点取最近的未匹配网格点
+    matched_index = greedy_match(cand_grid, bounds, len(grid_points))
+    matched = matched_index >= 0
+    
+    # 记录匹配结果
+    matched_sources = sorted_shots[matched]
+    matched_shots = grid_points[matched_index[matched]]
     
-    return shot_to_grid, np.array(matched_shots)
+    return matched_sources, matched_shots
+
+def copy_kept_traces(traces, new_traces, keep_mask, new_shots, batch_start, batch_end, new_start, pbar):
+    """将输入道[batch_start, batch_end)中保留的道复制到输出文件从new_start开始的区域, 炮点坐标替换为匹配结果"""
+    batch_mask = keep_mask[batch_start:batch_end]
+    # 整批都保留时直接从映射切片复制, 省去一次整条道记录的临时拷贝
+    kept = traces[batch_start:batch_end] if batch_mask.all() else traces[batch_start:batch_end][batch_mask]
+    new_end = new_start + len(kept)
+    new_batch = new_traces[new_start:new_end]
+
+    # 道数据按原始字节复制, 只保留需要的header属性, 其余道头字节保持为零
+    new_batch['data'] = kept['data']
+    for name in ('source_depth', 'trace_number', 'sample_count', 'sample_interval', 'group_x', 'group_y'):
+        new_batch[name] = kept[name]
+
+    # 炮点坐标替换为匹配到的网格点坐标(向零截断取整)
+    new_batch['source_x'] = new_shots[new_start:new_end, 0].astype(np.int32)
+    new_batch['source_y'] = new_shots[new_start:new_end, 1].astype(np.int32)
+    pbar.update(batch_end - batch_start)
 
 def process_segy_file(grid_file, segy_file, new_filename, max_distance, output_fig_path, batch_size=100000):
     """处理SEGY文件，将炮点匹配到网格点上"""
@@ -118,86 +166,70 @@ def process_segy_file(grid_file, segy_file, new_filename, max_distance, output_f
         spec.format = segyfile.format
         spec.sorting = segyfile.sorting
         
-        # 读取所有坐标
+        # 将道记录映射为结构化数组, 炮点坐标一次性读出(道头坐标为int32)
         print("\n读取所有坐标...")
-        sourceX = np.zeros(num_traces)
-        sourceY = np.zeros(num_traces)
-        groupX = np.zeros(num_traces)
-        groupY = np.zeros(num_traces)
-        
-        for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
-            batch_end = min(batch_start + batch_size, num_traces)
-            sourceX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceX)[batch_start:batch_end]
-            sourceY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceY)[batch_start:batch_end]
-            groupX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-            groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
+        traces = trace_memmap(segy_file, segyfile, KEPT_FIELDS, sequential=True)
+        sourceX = traces['source_x'].astype(np.int32)
+        sourceY = traces['source_y'].astype(np.int32)
         
         # 获取唯一的炮点坐标
-        unique_shots = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
+        unique_shots = unique_xy(sourceX, sourceY)
         print(f"\n原始唯一炮点数量: {len(unique_shots)}")
         
         # 匹配炮点到网格点
         print("\n进行炮点匹配...")
-        shot_to_grid, matched_shots = match_shots_to_grid(unique_shots, grid_points, max_distance)
+        matched_sources, matched_shots = match_shots_to_grid(unique_shots, grid_points, max_distance)
         print(f"成功匹配炮点数量: {len(matched_shots)}")
         
         # 绘制匹配结果对比图
         plot_match_result(unique_shots, matched_shots, grid_points, output_fig_path)
         
-        # 找出要保留的道的索引
-        keep_indices = []
-        for i in range(num_traces):
-            orig_shot = (sourceX[i], sourceY[i])
-            if orig_shot in shot_to_grid:
-                keep_indices.append(i)
+        # 已匹配炮点的原始坐标键(排序后)及对应的网格点坐标
+        matched_keys = pack_xy(matched_sources[:, 0], matched_sources[:, 1])
+        order = np.argsort(matched_keys)
+        matched_keys, matched_grid = matched_keys[order], matched_shots[order]
         
-        keep_indices = np.array(keep_indices)
+        # 每道只查找一次: 在已匹配炮点中的位置既用于判断是否保留, 也用于查出新的炮点坐标
+        trace_keys = pack_xy(sourceX, sourceY)
+        if len(matched_keys) > 0:
+            # 超出末尾的位置一定不匹配, 截断到最后一个键后再比较即可
+            shot_index = np.minimum(np.searchsorted(matched_keys, trace_keys), len(matched_keys) - 1)
+            keep_mask = matched_keys[shot_index] == trace_keys
+        else:
+            shot_index = np.zeros(num_traces, dtype=np.int64)
+            keep_mask = np.zeros(num_traces, dtype=bool)
+        num_kept = int(np.count_nonzero(keep_mask))
+        new_shots = matched_grid[shot_index[keep_mask]]
         print(f"\n原始道数: {num_traces}")
-        print(f"保留道数: {len(keep_indices)}")
+        print(f"保留道数: {num_kept}")
         
         # 更新spec中的道数
-        spec.tracecount = len(keep_indices)
+        spec.tracecount = num_kept
         
-        # 创建新的SEGY文件
+        # 创建新的SEGY文件并写入文本头和二进制头
         print("\n创建新的SEGY文件...")
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
-            
-            # 批量处理
-            for batch_start in tqdm(range(0, len(keep_indices), batch_size), desc="写入数据"):
-                batch_end = min(batch_start + batch_size, len(keep_indices))
-                batch_indices = keep_indices[batch_start:batch_end]
-                
-                # 批量读取这个批次的header属性
-                batch_headers = {
-                    'source_depth': segyfile.attributes(segyio.TraceField.SourceDepth)[batch_indices],
-                    'trace_number': segyfile.attributes(segyio.TraceField.TraceNumber)[batch_indices],
-                    'sample_count': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_indices],
-                    'sample_interval': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_indices]
-                }
-                
-                # 处理每个道
-                for i in range(len(batch_indices)):
-                    trace_index = batch_start + i
-                    orig_index = batch_indices[i]
-                    orig_shot = (sourceX[orig_index], sourceY[orig_index])
-                    new_shot = shot_to_grid[orig_shot]  # 这里一定能找到匹配，因为已经过滤过了
-                    
-                    # 写入道数据
-                    new_segy.trace.raw[trace_index] = segyfile.trace.raw[orig_index]
-                    
-                    # 写入header
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: batch_headers['source_depth'][i],
-                        segyio.TraceField.TraceNumber: batch_headers['trace_number'][i],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: batch_headers['sample_count'][i],
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: batch_headers['sample_interval'][i],
-                        segyio.TraceField.GroupX: int(groupX[orig_index]),
-                        segyio.TraceField.GroupY: int(groupY[orig_index]),
-                        segyio.TraceField.SourceX: int(new_shot[0]),
-                        segyio.TraceField.SourceY: int(new_shot[1])
-                    })
+
+        # 输出文件的道记录也映射为结构化数组, 道头和道数据按批次整块复制
+        new_traces = np.memmap(new_filename, mode="r+", offset=TRACE_DATA_OFFSET, shape=(num_kept,),
+                               dtype=traces.dtype)
+
+        # 按输入顺序分批, 每批保留的道写入输出文件中互不重叠的区域, 使用线程池并行复制
+        batch_starts = np.arange(0, len(keep_mask), batch_size)
+        batch_counts = np.add.reduceat(keep_mask, batch_starts, dtype=np.int64)
+        new_starts = np.cumsum(batch_counts) - batch_counts
+        with tqdm(total=len(keep_mask), desc="写入数据") as pbar:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                futures = [executor.submit(copy_kept_traces, traces, new_traces, keep_mask, new_shots,
+                                           batch_start, min(batch_start + batch_size, len(keep_mask)), new_start, pbar)
+                           for batch_start, new_start in zip(batch_starts, new_starts)]
+                for future in futures:
+                    future.result()
+
+        new_traces.flush()
+        del new_traces, traces
 
         print(f"\n新的SEGY文件已保存为: {new_filename}")
 
@@ -20,11 +20,94 @@
 - 匹配统计信息和对比图
 """
 
+import os
+import pickle
 import segyio
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
 from scipy.spatial import cKDTree
 import matplotlib.pyplot as plt
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, unique_xy, plot_points, set_equal_limits
+
+def coords_center(coords):
+    """计算坐标点的中心; 整数坐标直接用int64累加求和, 不为求均值把整个数组提升为float64"""
+    if np.issubdtype(coords.dtype, np.integer):
+        return coords.sum(axis=0, dtype=np.int64) / len(coords)
+    return np.mean(coords, axis=0)
+
+def rectilinear_axes(grid_points):
+    """
+    网格点恰好是一组x坐标与一组y坐标的笛卡尔积(规则矩形网格, 间距可以不均匀)时,
+    返回排好序的x、y坐标轴, 否则返回None
+    """
+    unique_x = np.unique(grid_points[:, 0])
+    unique_y = np.unique(grid_points[:, 1])
+    if len(grid_points) != len(unique_x) * len(unique_y):
+        return None
+    order = np.lexsort((grid_points[:, 1], grid_points[:, 0]))
+    if not (np.array_equal(grid_points[order, 0], np.repeat(unique_x, len(unique_y))) and
+            np.array_equal(grid_points[order, 1], np.tile(unique_y, len(unique_x)))):
+        return None
+    return unique_x, unique_y
+
+def nearest_on_axis(axis_values, values):
+    """
+    在排好序的坐标轴上找每个值最近的坐标序号, 超出范围的值取两端;
+    同时返回恰好位于两个相邻坐标正中间(最近坐标不唯一)的标记
+    """
+    right = np.clip(np.searchsorted(axis_values, values), 1, len(axis_values) - 1)
+    left_dist = values - axis_values[right - 1]
+    right_dist = axis_values[right] - values
+    return np.where(left_dist < right_dist, right - 1, right), left_dist == right_dist
+
+def grid_tree(grid_file, grid_points):
+    """
+    返回网格点的KD树, 缓存在grid_file旁的.kdtree.pkl文件中,
+    缓存不早于网格文件且树中的点与grid_points一致时直接加载, 否则重新建树并写入缓存
+    """
+    cache = grid_file + '.kdtree.pkl'
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(grid_file):
+        with open(cache, 'rb') as f:
+            tree = pickle.load(f)
+        # 网格文件可能被保留了较早修改时间的副本替换, 比对树中保存的点确认缓存属于当前网格
+        if tree.data.shape == grid_points.shape and np.array_equal(tree.data, grid_points):
+            return tree
+
+    tree = cKDTree(grid_points)
+    try:
+        with open(cache, 'wb') as f:
+            pickle.dump(tree, f, protocol=4)
+    except OSError:
+        # 缓存写入失败不影响匹配
+        pass
+    return tree
+
+def match_to_grid(grid_file, grid_points, points):
+    """
+    将每个点匹配到最近的网格点, 返回匹配距离和匹配到的网格点坐标
+    规则矩形网格上最近网格点的x、y可分别在两个坐标轴上二分查找得到, 不必建KD树;
+    最近网格点不唯一的点及非规则网格仍用KD树查询(多线程), 与原来的匹配结果保持一致
+    """
+    axes = rectilinear_axes(grid_points) if len(grid_points) > 1 else None
+    if axes is None:
+        distances, indices = grid_tree(grid_file, grid_points).query(points, workers=-1)
+        return distances, grid_points[indices]
+
+    x_index, x_tie = nearest_on_axis(axes[0], points[:, 0])
+    y_index, y_tie = nearest_on_axis(axes[1], points[:, 1])
+    matched_coords = np.column_stack((axes[0][x_index], axes[1][y_index]))
+    # 整数坐标的差值平方可能超出int32范围, 先转为float64再求距离
+    diff = (points - matched_coords).astype(np.float64)
+    distances = np.hypot(diff[:, 0], diff[:, 1])
+
+    tie = x_tie | y_tie
+    if tie.any():
+        tie_distances, tie_indices = grid_tree(grid_file, grid_points).query(points[tie], workers=-1)
+        distances[tie] = tie_distances
+        matched_coords[tie] = grid_points[tie_indices]
+    return distances, matched_coords
 
 def plot_match_result(orig_coords, shifted_coords, grid_points, matched_coords, 
                      orig_source_coords, shifted_source_coords, output_path):
@@ -32,46 +115,37 @@ def plot_match_result(orig_coords, shifted_coords, grid_points, matched_coords,
     fig, (ax1, ax2, ax3) = plt.subplots(3, 1, figsize=(20, 30))
     
     # 绘制原始分布
-    ax1.scatter(grid_points[:, 0], grid_points[:, 1], 
-               color='red', alpha=0.5, s=10, label='Grid Points')
-    ax1.scatter(orig_coords[:, 0], orig_coords[:, 1], 
-               color='blue', alpha=0.5, s=10, label='Original Receivers')
-    ax1.scatter(orig_source_coords[:, 0], orig_source_coords[:, 1],
-               color='green', alpha=0.5, s=10, label='Original Sources')
+    set_equal_limits(ax1, grid_points, orig_coords, orig_source_coords)
+    plot_points(ax1, grid_points, 'red', 'Reds', label='Grid Points')
+    plot_points(ax1, orig_coords, 'blue', 'Blues', label='Original Receivers')
+    plot_points(ax1, orig_source_coords, 'green', 'Greens', label='Original Sources')
     ax1.set_title("Before Shift")
     ax1.set_xlabel('X Coordinate')
     ax1.set_ylabel('Y Coordinate')
     ax1.legend()
     ax1.grid(True)
-    ax1.set_aspect('equal')
 
     # 绘制偏移后的分布
-    ax2.scatter(grid_points[:, 0], grid_points[:, 1], 
-               color='red', alpha=0.5, s=10, label='Grid Points')
-    ax2.scatter(shifted_coords[:, 0], shifted_coords[:, 1], 
-               color='blue', alpha=0.5, s=10, label='Shifted Receivers')
-    ax2.scatter(shifted_source_coords[:, 0], shifted_source_coords[:, 1],
-               color='green', alpha=0.5, s=10, label='Shifted Sources')
+    set_equal_limits(ax2, grid_points, shifted_coords, shifted_source_coords)
+    plot_points(ax2, grid_points, 'red', 'Reds', label='Grid Points')
+    plot_points(ax2, shifted_coords, 'blue', 'Blues', label='Shifted Receivers')
+    plot_points(ax2, shifted_source_coords, 'green', 'Greens', label='Shifted Sources')
     ax2.set_title("After Shift")
     ax2.set_xlabel('X Coordinate')
     ax2.set_ylabel('Y Coordinate')
     ax2.legend()
     ax2.grid(True)
-    ax2.set_aspect('equal')
 
     # 绘制匹配后的分布
-    ax3.scatter(grid_points[:, 0], grid_points[:, 1], 
-               color='red', alpha=0.5, s=10, label='Grid Points')
-    ax3.scatter(matched_coords[:, 0], matched_coords[:, 1], 
-               color='blue', alpha=0.5, s=10, label='Matched Receivers')
-    ax3.scatter(shifted_source_coords[:, 0], shifted_source_coords[:, 1],
-               color='green', alpha=0.5, s=10, label='Shifted Sources')
+    set_equal_limits(ax3, grid_points, matched_coords, shifted_source_coords)
+    plot_points(ax3, grid_points, 'red', 'Reds', label='Grid Points')
+    plot_points(ax3, matched_coords, 'blue', 'Blues', label='Matched Receivers')
+    plot_points(ax3, shifted_source_coords, 'green', 'Greens', label='Shifted Sources')
     ax3.set_title("After Matching")
     ax3.set_xlabel('X Coordinate')
     ax3.set_ylabel('Y Coordinate')
     ax3.legend()
     ax3.grid(True)
-    ax3.set_aspect('equal')
 
     plt.suptitle("Receiver Points Matching Process", fontsize=16)
     plt.tight_layout()
@@ -80,12 +154,31 @@ def plot_match_result(orig_coords, shifted_coords, grid_points, matched_coords,
     
     print(f"匹配过程对比图已保存为: {output_path}")
 
+def copy_matched_traces(traces, new_traces, receiver_ids, matched_xy, shifted_sourceX, shifted_sourceY,
+                        batch_start, batch_end, pbar):
+    """将输入道[batch_start, batch_end)复制到输出文件的相同位置, 检波点坐标替换为匹配结果"""
+    batch = traces[batch_start:batch_end]
+    new_batch = new_traces[batch_start:batch_end]
+
+    # 道数据按原始字节复制, 只保留需要的header属性, 其余道头字节保持为零
+    new_batch['data'] = batch['data']
+    for name in ('source_depth', 'trace_number', 'sample_count', 'sample_interval'):
+        new_batch[name] = batch[name]
+
+    # 检波点坐标替换为匹配到的网格点坐标, 按每道的唯一检波点序号取出
+    matched = matched_xy[receiver_ids[batch_start:batch_end]]
+    new_batch['group_x'] = matched[:, 0]
+    new_batch['group_y'] = matched[:, 1]
+    new_batch['source_x'] = shifted_sourceX[batch_start:batch_end]
+    new_batch['source_y'] = shifted_sourceY[batch_start:batch_end]
+    pbar.update(batch_end - batch_start)
+
 def process_segy_file(grid_file, segy_file, new_filename, output_fig_path, batch_size=100000):
     """处理SEGY文件，将检波点匹配到网格点上"""
     # 加载网格点坐标
     print("\n加载网格点坐标...")
     grid_points = np.load(grid_file)
-    grid_center = np.mean(grid_points, axis=0)
+    grid_center = coords_center(grid_points)
     print(f"网格点数量: {len(grid_points)}")
     print(f"网格中心点: ({grid_center[0]:.2f}, {grid_center[1]:.2f})")
     
@@ -106,22 +199,26 @@ def process_segy_file(grid_file, segy_file, new_filename, output_fig_path, batch
         
         # 读取所有坐标
         print("\n读取所有坐标...")
-        groupX = np.zeros(num_traces)
-        groupY = np.zeros(num_traces)
-        sourceX = np.zeros(num_traces)
-        sourceY = np.zeros(num_traces)
+        groupX = np.empty(num_traces, dtype=np.int32)
+        groupY = np.empty(num_traces, dtype=np.int32)
+        sourceX = np.empty(num_traces, dtype=np.int32)
+        sourceY = np.empty(num_traces, dtype=np.int32)
         
+        # 将道记录映射为结构化数组
+        traces = trace_memmap(segy_file, segyfile, KEPT_FIELDS)
         for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
             batch_end = min(batch_start + batch_size, num_traces)
-            groupX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-            groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
-            sourceX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceX)[batch_start:batch_end]
-            sourceY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceY)[batch_start:batch_end]
+            # 一次取出这批道记录, 四个坐标字段从同一块内存中拆出, 道头只扫描一遍
+            batch = traces[batch_start:batch_end]
+            groupX[batch_start:batch_end] = batch['group_x']
+            groupY[batch_start:batch_end] = batch['group_y']
+            sourceX[batch_start:batch_end] = batch['source_x']
+            sourceY[batch_start:batch_end] = batch['source_y']
         
         # 获取唯一的检波点和炮点坐标
-        orig_coords = np.unique(np.column_stack((groupX, groupY)), axis=0)
-        orig_source_coords = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
-        orig_center = np.mean(orig_coords, axis=0)
+        orig_coords = unique_xy(groupX, groupY)
+        orig_source_coords = unique_xy(sourceX, sourceY)
+        orig_center = coords_center(orig_coords)
         print(f"\n原始唯一检波点数量: {len(orig_coords)}")
         print(f"原始唯一炮点数量: {len(orig_source_coords)}")
         print(f"检波点中心点: ({orig_center[0]:.2f}, {orig_center[1]:.2f})")
@@ -130,19 +227,19 @@ def process_segy_file(grid_file, segy_file, new_filename, output_fig_path, batch
         offset = np.round(grid_center - orig_center).astype(int)
         print(f"\n计算得到的偏移量: ({offset[0]}, {offset[1]})")
         
-        # 对所有检波点和炮点坐标进行偏移
-        shifted_groupX = groupX + offset[0]
-        shifted_groupY = groupY + offset[1]
+        # 对所有检波点坐标原地进行偏移, 炮点坐标保持不变
+        np.add(groupX, offset[0], out=groupX)
+        np.add(groupY, offset[1], out=groupY)
         shifted_sourceX = sourceX #+ offset[0]
         shifted_sourceY = sourceY #+ offset[1]
         
-        shifted_coords = np.unique(np.column_stack((shifted_groupX, shifted_groupY)), axis=0)
-        shifted_source_coords = np.unique(np.column_stack((shifted_sourceX, shifted_sourceY)), axis=0)
+        # 记录每道对应的唯一检波点序号, 匹配结果可直接按道取出
+        shifted_coords, receiver_ids = unique_xy(groupX, groupY, return_inverse=True)
+        shifted_source_coords = orig_source_coords
         
-        # 使用KD树进行最近点匹配
+        # 最近网格点匹配
         print("\n进行检波点匹配...")
-        tree = cKDTree(grid_points)
-        distances, indices = tree.query(shifted_coords)
+        distances, matched_coords = match_to_grid(grid_file, grid_points, shifted_coords)
         
         # 统计匹配结果
         max_dist = np.max(distances)
@@ -150,56 +247,40 @@ def process_segy_file(grid_file, segy_file, new_filename, output_fig_path, batch
         print(f"最大匹配距离: {max_dist:.2f}")
         print(f"平均匹配距离: {mean_dist:.2f}")
         
-        # 获取匹配后的坐标
-        matched_coords = grid_points[indices]
-        
-        # 创建检波点到网格点的映射
-        receiver_to_grid = {tuple(shifted): tuple(matched) 
-                          for shifted, matched in zip(shifted_coords, matched_coords)}
+        # 每个唯一检波点匹配到的网格点坐标, 按写入道头的方式向零截断取整
+        matched_xy = matched_coords.astype(np.int32)
         
-        # 绘制对比图
-        plot_match_result(orig_coords, shifted_coords, grid_points, matched_coords, 
-                         orig_source_coords, shifted_source_coords, output_fig_path)
+        # 在后台进程中绘制对比图, 与写入新的SEGY文件同时进行;
+        # 子进程以spawn方式启动, 不继承本进程中线程持有的锁; 图片目录先在主进程中创建
+        os.makedirs(os.path.dirname(output_fig_path) or '.', exist_ok=True)
+        plot_process = get_context("spawn").Process(target=plot_match_result,
+                                                    args=(orig_coords, shifted_coords, grid_points, matched_coords,
+                                                          orig_source_coords, shifted_source_coords, output_fig_path))
+        plot_process.start()
         
-        # 创建新的SEGY文件
+        # 创建新的SEGY文件, 只写入文本头和二进制头
         print("\n创建新的SEGY文件...")
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
-            
-            # 批量处理
-            for batch_start in tqdm(range(0, num_traces, batch_size), desc="写入数据"):
-                batch_end = min(batch_start + batch_size, num_traces)
-                
-                # 批量读取这个批次的header属性
-                batch_headers = {
-                    'source_depth': segyfile.attributes(segyio.TraceField.SourceDepth)[batch_start:batch_end],
-                    'trace_number': segyfile.attributes(segyio.TraceField.TraceNumber)[batch_start:batch_end],
-                    'sample_count': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_start:batch_end],
-                    'sample_interval': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_start:batch_end]
-                }
-                
-                # 处理每个道
-                for i in range(batch_end - batch_start):
-                    trace_index = batch_start + i
-                    shifted_coord = (shifted_groupX[trace_index], shifted_groupY[trace_index])
-                    matched_coord = receiver_to_grid[shifted_coord]
-                    
-                    # 写入道数据
-                    new_segy.trace.raw[trace_index] = segyfile.trace.raw[trace_index]
-                    
-                    # 写入header
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: batch_headers['source_depth'][i],
-                        segyio.TraceField.TraceNumber: batch_headers['trace_number'][i],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: batch_headers['sample_count'][i],
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: batch_headers['sample_interval'][i],
-                        segyio.TraceField.GroupX: int(matched_coord[0]),
-                        segyio.TraceField.GroupY: int(matched_coord[1]),
-                        segyio.TraceField.SourceX: int(shifted_sourceX[trace_index]),
-                        segyio.TraceField.SourceY: int(shifted_sourceY[trace_index])
-                    })
 
+        # 输出文件的道记录也映射为结构化数组, 各批次写入互不重叠的区域, 使用线程池并行复制
+        new_traces = np.memmap(new_filename, mode="r+", offset=TRACE_DATA_OFFSET, shape=(num_traces,),
+                               dtype=traces.dtype)
+        with tqdm(total=num_traces, desc="写入数据") as pbar:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                futures = [executor.submit(copy_matched_traces, traces, new_traces, receiver_ids, matched_xy,
+                                           shifted_sourceX, shifted_sourceY,
+                                           batch_start, min(batch_start + batch_size, num_traces), pbar)
+                           for batch_start in range(0, num_traces, batch_size)]
+                for future in futures:
+                    future.result()
+
+        new_traces.flush()
+        del new_traces, traces
+        plot_process.join()
+        if plot_process.exitcode != 0:
+            raise RuntimeError(f"绘图进程异常退出, 返回码 {plot_process.exitcode}")
         print(f"\n新的SEGY文件已保存为: {new_filename}")
 
 if __name__ == "__main__":
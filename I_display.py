@@ -21,6 +21,9 @@ import segyio
 import numpy as np
 import matplotlib.pyplot as plt
 from tqdm import tqdm
+from contextlib import ExitStack
+from concurrent.futures import ThreadPoolExecutor
+from segy_utils import COORD_FIELDS, trace_memmap, unique_xy, plot_points
 
 def plot_distribution(receivers, sources, vel_points, output_path):
     """绘制检波点、炮点和速度点的分布图"""
@@ -28,24 +31,20 @@ def plot_distribution(receivers, sources, vel_points, output_path):
     ax = plt.gca()
 
     # 先去重再画图,提高绘图效率
-    unique_receivers = np.unique(receivers, axis=0)
-    unique_sources = np.unique(sources, axis=0)
-    unique_vel_points = np.unique(vel_points, axis=0)
+    unique_receivers = unique_xy(receivers[:, 0], receivers[:, 1])
+    unique_sources = unique_xy(sources[:, 0], sources[:, 1])
+    unique_vel_points = unique_xy(vel_points[:, 0], vel_points[:, 1])
 
     # 绘制速度点
-    ax.scatter(unique_vel_points[:, 0], unique_vel_points[:, 1], 
-              color='blue', marker='o', s=10, 
-              label=f"Velocity Points ({len(unique_vel_points)})", alpha=1)
+    plot_points(ax, unique_vel_points, 'blue', 'Blues',
+                label=f"Velocity Points ({len(unique_vel_points)})", alpha=1)
     
     # 绘制检波点
-    ax.scatter(unique_receivers[:, 0], unique_receivers[:, 1], 
-              color='yellow', marker='*', s=10, 
-              label=f"Receivers ({len(unique_receivers)})", alpha=1)
+    plot_points(ax, unique_receivers, 'yellow', 'Wistia',
+                label=f"Receivers ({len(unique_receivers)})", alpha=1, marker='*')
     
     # 绘制炮点
-    ax.scatter(unique_sources[:, 0], unique_sources[:, 1], 
-              color='red', marker='o', s=10, 
-              label=f"Sources ({len(unique_sources)})", alpha=1)
+    plot_points(ax, unique_sources, 'red', 'Reds', label=f"Sources ({len(unique_sources)})", alpha=1)
 
     # 添加标题和标签
     ax.set_title("Distribution of Sources, Receivers and Velocity Points", fontsize=16)
@@ -67,7 +66,7 @@ def plot_distribution(receivers, sources, vel_points, output_path):
     
     print(f"\n分布图已保存为: {output_path}")
 
-def read_coordinates(segyfile, batch_size):
+def read_coordinates(filename, segyfile, batch_size):
     """从SEGY文件中批量读取坐标"""
     num_traces = segyfile.tracecount
     sourceX = np.zeros(num_traces)
@@ -75,27 +74,29 @@ def read_coordinates(segyfile, batch_size):
     groupX = np.zeros(num_traces)
     groupY = np.zeros(num_traces)
     
+    # 将道记录映射为结构化数组, 每批道头只扫描一遍, 四个坐标字段从同一块内存中拆出
+    traces = trace_memmap(filename, segyfile, COORD_FIELDS, with_data=False)
     for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
         batch_end = min(batch_start + batch_size, num_traces)
-        sourceX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceX)[batch_start:batch_end]
-        sourceY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceY)[batch_start:batch_end]
-        groupX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-        groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
+        batch = traces[batch_start:batch_end]
+        sourceX[batch_start:batch_end] = batch['source_x']
+        sourceY[batch_start:batch_end] = batch['source_y']
+        groupX[batch_start:batch_end] = batch['group_x']
+        groupY[batch_start:batch_end] = batch['group_y']
+    del traces
     
     return sourceX, sourceY, groupX, groupY
 
 def display_geometry(shots_files, vel_file, output_fig_path, batch_size=100000):
     """处理多个炮集和速度模型SEGY文件并显示几何分布"""
-    # 初始化存储所有炮集坐标的数组
-    all_shots_sourceX = []
-    all_shots_sourceY = []
-    all_shots_groupX = []
-    all_shots_groupY = []
-    
-    # 读取所有炮集文件
-    print("\n读取炮集文件...")
-    for shots_file in shots_files:
-        with segyio.open(shots_file, "r", ignore_geometry=True) as segyfile:
+    # 各文件依次打开并输出文件信息, 坐标读取提交到线程池, 多个文件的读取同时进行;
+    # 所有文件保持打开直到读取完成
+    with ExitStack() as stack, ThreadPoolExecutor(max_workers=min(8, len(shots_files) + 1)) as executor:
+        # 读取所有炮集文件
+        print("\n读取炮集文件...")
+        shots_futures = []
+        for shots_file in shots_files:
+            segyfile = stack.enter_context(segyio.open(shots_file, "r", ignore_geometry=True))
             if segyfile.mmap():
                 print(f"文件 {shots_file} 已成功进行内存映射")
             else:
@@ -106,21 +107,11 @@ def display_geometry(shots_files, vel_file, output_fig_path, batch_size=100000):
             print(f"采样点数: {len(segyfile.samples)}")
             
             # 读取炮集坐标
-            sourceX, sourceY, groupX, groupY = read_coordinates(segyfile, batch_size)
-            all_shots_sourceX.extend(sourceX)
-            all_shots_sourceY.extend(sourceY)
-            all_shots_groupX.extend(groupX)
-            all_shots_groupY.extend(groupY)
-    
-    # 转换为numpy数组
-    all_shots_sourceX = np.array(all_shots_sourceX)
-    all_shots_sourceY = np.array(all_shots_sourceY)
-    all_shots_groupX = np.array(all_shots_groupX)
-    all_shots_groupY = np.array(all_shots_groupY)
-    
-    # 读取速度模型文件
-    print("\n读取速度模型文件...")
-    with segyio.open(vel_file, "r", ignore_geometry=True) as segyfile:
+            shots_futures.append(executor.submit(read_coordinates, shots_file, segyfile, batch_size))
+        
+        # 读取速度模型文件
+        print("\n读取速度模型文件...")
+        segyfile = stack.enter_context(segyio.open(vel_file, "r", ignore_geometry=True))
         if segyfile.mmap():
             print(f"文件 {vel_file} 已成功进行内存映射")
         else:
@@ -131,13 +122,20 @@ def display_geometry(shots_files, vel_file, output_fig_path, batch_size=100000):
         print(f"采样点数: {len(segyfile.samples)}")
         
         # 读取速度模型坐标
-        vel_sourceX, vel_sourceY, vel_groupX, vel_groupY = read_coordinates(segyfile, batch_size)
+        vel_future = executor.submit(read_coordinates, vel_file, segyfile, batch_size)
+        
+        shots_coords = [future.result() for future in shots_futures]
+        vel_sourceX, vel_sourceY, vel_groupX, vel_groupY = vel_future.result()
+    
+    # 拼接为numpy数组, 不经过逐个元素的Python列表
+    all_shots_sourceX, all_shots_sourceY, all_shots_groupX, all_shots_groupY = (
+        np.concatenate(arrays) for arrays in zip(*shots_coords))
     
     # 获取唯一的坐标点
     print("\n处理坐标...")
-    unique_receivers = np.unique(np.column_stack((all_shots_groupX, all_shots_groupY)), axis=0)
-    unique_sources = np.unique(np.column_stack((all_shots_sourceX, all_shots_sourceY)), axis=0)
-    unique_vel_points = np.unique(np.column_stack((vel_groupX, vel_groupY)), axis=0)
+    unique_receivers = unique_xy(all_shots_groupX, all_shots_groupY)
+    unique_sources = unique_xy(all_shots_sourceX, all_shots_sourceY)
+    unique_vel_points = unique_xy(vel_groupX, vel_groupY)
     
     # 输出统计信息
     print(f"\n统计信息:")
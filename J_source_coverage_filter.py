@@ -16,55 +16,55 @@
 - 筛选前后的对比图
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
 import matplotlib.pyplot as plt
+from numba import njit, prange
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, unique_xy, plot_points, set_equal_limits
 
 def plot_filter_result(groupX, groupY, sourceX, sourceY, 
                       keep_indices, output_path):
     """绘制过滤前后的观测系统对比图"""
     # 去重处理原始坐标
-    unique_orig_coords = np.unique(np.column_stack((groupX, groupY)), axis=0)
-    unique_orig_source = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
+    unique_orig_coords = unique_xy(groupX, groupY)
+    unique_orig_source = unique_xy(sourceX, sourceY)
     
     # 获取过滤后的坐标并去重
     filtered_sourceX = sourceX[keep_indices]
     filtered_sourceY = sourceY[keep_indices]
     filtered_groupX = groupX[keep_indices]
     filtered_groupY = groupY[keep_indices]
-    unique_filtered_coords = np.unique(np.column_stack((filtered_groupX, filtered_groupY)), axis=0)
-    unique_filtered_source = np.unique(np.column_stack((filtered_sourceX, filtered_sourceY)), axis=0)
+    unique_filtered_coords = unique_xy(filtered_groupX, filtered_groupY)
+    unique_filtered_source = unique_xy(filtered_sourceX, filtered_sourceY)
     
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
     
     # 绘制过滤前的坐标
-    ax1.scatter(unique_orig_coords[:, 0], unique_orig_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_orig_coords)})', 
-               alpha=0.5, s=10)
-    ax1.scatter(unique_orig_source[:, 0], unique_orig_source[:, 1], 
-               color='red', label=f'Sources ({len(unique_orig_source)})', 
-               alpha=0.8, s=20)
+    set_equal_limits(ax1, unique_orig_coords, unique_orig_source)
+    plot_points(ax1, unique_orig_coords, 'blue', 'Blues', label=f'Receivers ({len(unique_orig_coords)})')
+    plot_points(ax1, unique_orig_source, 'red', 'Reds',
+                label=f'Sources ({len(unique_orig_source)})', alpha=0.8, s=20)
     ax1.set_title("Before Filtering")
     ax1.set_xlabel('X Coordinate')
     ax1.set_ylabel('Y Coordinate')
     ax1.legend()
     ax1.grid(True)
-    ax1.set_aspect('equal')
     
     # 绘制过滤后的坐标
-    ax2.scatter(unique_filtered_coords[:, 0], unique_filtered_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_filtered_coords)})', 
-               alpha=0.5, s=10)
-    ax2.scatter(unique_filtered_source[:, 0], unique_filtered_source[:, 1], 
-               color='red', label=f'Sources ({len(unique_filtered_source)})', 
-               alpha=0.8, s=20)
+    set_equal_limits(ax2, unique_filtered_coords, unique_filtered_source)
+    plot_points(ax2, unique_filtered_coords, 'blue', 'Blues',
+                label=f'Receivers ({len(unique_filtered_coords)})')
+    plot_points(ax2, unique_filtered_source, 'red', 'Reds',
+                label=f'Sources ({len(unique_filtered_source)})', alpha=0.8, s=20)
     ax2.set_title("After Filtering")
     ax2.set_xlabel('X Coordinate')
     ax2.set_ylabel('Y Coordinate')
     ax2.legend()
     ax2.grid(True)
-    ax2.set_aspect('equal')
     
     plt.suptitle("Source Coverage Filter Result", fontsize=16)
     plt.tight_layout()
@@ -76,6 +76,50 @@ def plot_filter_result(groupX, groupY, sourceX, sourceY,
     print(f"炮点数量: {len(unique_orig_source)} -> {len(unique_filtered_source)}")
     print(f"对比图已保存为: {output_path}")
 
+def copy_kept_traces(traces, new_traces, keep_indices, groupX, groupY, sourceX, sourceY,
+                     batch_start, batch_end, pbar):
+    """将keep_indices[batch_start:batch_end]指向的输入道复制到输出文件[batch_start, batch_end)"""
+    batch_indices = keep_indices[batch_start:batch_end]
+    # 保留的道在输入中连续时直接从映射切片复制, 省去一次整条道记录的临时拷贝
+    if np.all(np.diff(batch_indices) == 1):
+        kept = traces[batch_indices[0]:batch_indices[-1] + 1]
+    else:
+        kept = traces[batch_indices]
+    new_batch = new_traces[batch_start:batch_end]
+
+    # 道数据按原始字节复制, 只保留需要的header属性, 其余道头字节保持为零
+    new_batch['data'] = kept['data']
+    for name in ('source_depth', 'trace_number', 'sample_count', 'sample_interval'):
+        new_batch[name] = kept[name]
+    new_batch['group_x'] = groupX[batch_indices].astype(np.int32)
+    new_batch['group_y'] = groupY[batch_indices].astype(np.int32)
+    new_batch['source_x'] = sourceX[batch_indices].astype(np.int32)
+    new_batch['source_y'] = sourceY[batch_indices].astype(np.int32)
+    pbar.update(batch_end - batch_start)
+
+@njit(parallel=True, cache=True)
+def coverage_mask(groupX, groupY, order, starts, unique_sources):
+    """
+    order中每个炮点的道连续排列, 第s个炮点的道为order[starts[s]:starts[s+1]],
+    逐炮点并行计算其检波点的矩形覆盖范围, 返回炮点是否位于覆盖范围内
+    """
+    num_sources = unique_sources.shape[0]
+    covered = np.empty(num_sources, dtype=np.bool_)
+    for s in prange(num_sources):
+        begin = starts[s]
+        end = starts[s + 1] if s + 1 < num_sources else order.shape[0]
+        x_min = x_max = groupX[order[begin]]
+        y_min = y_max = groupY[order[begin]]
+        for i in range(begin + 1, end):
+            x = groupX[order[i]]
+            y = groupY[order[i]]
+            x_min = min(x_min, x)
+            x_max = max(x_max, x)
+            y_min = min(y_min, y)
+            y_max = max(y_max, y)
+        covered[s] = (x_min <= unique_sources[s, 0] <= x_max) and (y_min <= unique_sources[s, 1] <= y_max)
+    return covered
+
 def filter_sources_by_coverage(filename, new_filename, batch_size=100000):
     """根据检波点覆盖范围过滤炮点"""
     with segyio.open(filename, "r", ignore_geometry=True) as segyfile:
@@ -98,80 +142,62 @@ def filter_sources_by_coverage(filename, new_filename, batch_size=100000):
         
         # 分批读取坐标
         print("\n读取坐标...")
+        # 将道记录映射为结构化数组
+        traces = trace_memmap(filename, segyfile, KEPT_FIELDS)
         for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
             batch_end = min(batch_start + batch_size, num_traces)
-            sourceX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceX)[batch_start:batch_end]
-            sourceY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceY)[batch_start:batch_end]
-            groupX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-            groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
+            # 一次取出这批道记录, 四个坐标字段从同一块内存中拆出, 道头只扫描一遍
+            batch = traces[batch_start:batch_end]
+            sourceX[batch_start:batch_end] = batch['source_x']
+            sourceY[batch_start:batch_end] = batch['source_y']
+            groupX[batch_start:batch_end] = batch['group_x']
+            groupY[batch_start:batch_end] = batch['group_y']
 
-        # 获取唯一的炮点
-        unique_sources = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
+        # 获取唯一的炮点, 并记录每道所属炮点的序号
+        unique_sources, source_ids = unique_xy(sourceX, sourceY, return_inverse=True)
         print(f"\n开始检查 {len(unique_sources)} 个炮点...")
         
-        # 找出要保留的道的索引
-        keep_indices = []
-        for source in tqdm(unique_sources, desc="处理炮点"):
-            # 找出该炮点对应的所有检波点
-            source_mask = (sourceX == source[0]) & (sourceY == source[1])
-            source_traces = np.where(source_mask)[0]
-            receivers_x = groupX[source_mask]
-            receivers_y = groupY[source_mask]
-            
-            # 计算检波点的覆盖范围
-            x_min, x_max = np.min(receivers_x), np.max(receivers_x)
-            y_min, y_max = np.min(receivers_y), np.max(receivers_y)
-            
-            # 如果炮点在覆盖范围内，保留其所有道
-            if x_min <= source[0] <= x_max and y_min <= source[1] <= y_max:
-                keep_indices.extend(source_traces)
+        # 按炮点序号稳定排序, 同一炮点的道连续排列且保持原有先后顺序
+        order = np.argsort(source_ids, kind='stable')
+        starts = np.searchsorted(source_ids[order], np.arange(len(unique_sources)))
         
-        keep_indices = np.array(keep_indices)
+        # 一次遍历得到每个炮点对应检波点的覆盖范围, 如果炮点在覆盖范围内，保留其所有道(按炮点顺序排列)
+        covered = coverage_mask(groupX, groupY, order, starts, unique_sources)
+        keep_indices = order[covered[source_ids[order]]]
         spec.tracecount = len(keep_indices)
         
-        # 绘制过滤前后的对比图
-        plot_filter_result(groupX, groupY, sourceX, sourceY, 
-                         keep_indices, "../fig_0118/J_source_coverage_filter_result.png")
+        # 在后台进程中绘制过滤前后的对比图, 与写入新的SEGY文件同时进行;
+        # 子进程以spawn方式启动, 不继承本进程中线程持有的锁; 图片目录先在主进程中创建
+        output_fig_path = "../fig_0118/J_source_coverage_filter_result.png"
+        os.makedirs(os.path.dirname(output_fig_path), exist_ok=True)
+        plot_process = get_context("spawn").Process(target=plot_filter_result,
+                                                    args=(groupX, groupY, sourceX, sourceY,
+                                                          keep_indices, output_fig_path))
+        plot_process.start()
 
-        # 创建新的SEGY文件
+        # 创建新的SEGY文件, 只写入文本头和二进制头
         print("\n创建新的SEGY文件...")
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
 
-            # 批量处理
-            for batch_start in tqdm(range(0, len(keep_indices), batch_size), desc="写入数据"):
-                batch_end = min(batch_start + batch_size, len(keep_indices))
-                batch_indices = keep_indices[batch_start:batch_end]
-                
-                # 批量读取这个批次的header属性
-                batch_headers = {
-                    'source_depth': segyfile.attributes(segyio.TraceField.SourceDepth)[batch_indices],
-                    'trace_number': segyfile.attributes(segyio.TraceField.TraceNumber)[batch_indices],
-                    'sample_count': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_indices],
-                    'sample_interval': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_indices]
-                }
-                
-                # 处理每个道
-                for i in range(len(batch_indices)):
-                    trace_index = batch_start + i
-                    orig_index = batch_indices[i]
-                    
-                    # 写入道数据
-                    new_segy.trace.raw[trace_index] = segyfile.trace.raw[orig_index]
-                    
-                    # 写入header
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: batch_headers['source_depth'][i],
-                        segyio.TraceField.TraceNumber: batch_headers['trace_number'][i],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: batch_headers['sample_count'][i],
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: batch_headers['sample_interval'][i],
-                        segyio.TraceField.GroupX: int(groupX[orig_index]),
-                        segyio.TraceField.GroupY: int(groupY[orig_index]),
-                        segyio.TraceField.SourceX: int(sourceX[orig_index]),
-                        segyio.TraceField.SourceY: int(sourceY[orig_index])
-                    })
+        # 输出文件的道记录也映射为结构化数组, 各批次写入互不重叠的区域, 使用线程池并行复制
+        new_traces = np.memmap(new_filename, mode="r+", offset=TRACE_DATA_OFFSET, shape=(len(keep_indices),),
+                               dtype=traces.dtype)
+        with tqdm(total=len(keep_indices), desc="写入数据") as pbar:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                futures = [executor.submit(copy_kept_traces, traces, new_traces, keep_indices,
+                                           groupX, groupY, sourceX, sourceY,
+                                           batch_start, min(batch_start + batch_size, len(keep_indices)), pbar)
+                           for batch_start in range(0, len(keep_indices), batch_size)]
+                for future in futures:
+                    future.result()
 
+        new_traces.flush()
+        del new_traces, traces
+        plot_process.join()
+        if plot_process.exitcode != 0:
+            raise RuntimeError(f"绘图进程异常退出, 返回码 {plot_process.exitcode}")
         print(f"\n新的SEGY文件已保存为: {new_filename}")
 
 if __name__ == "__main__":
@@ -16,50 +16,48 @@
 - 平移前后的对比图
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import get_context
 import matplotlib.pyplot as plt
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, unique_xy, plot_points, set_equal_limits
 
-def plot_shift_result(orig_groupX, orig_groupY, orig_sourceX, orig_sourceY,
-                     shifted_groupX, shifted_groupY, shifted_sourceX, shifted_sourceY,
-                     output_path):
-    """绘制平移前后的对比图"""
-    # 去重处理坐标
-    unique_orig_coords = np.unique(np.column_stack((orig_groupX, orig_groupY)), axis=0)
-    unique_orig_source = np.unique(np.column_stack((orig_sourceX, orig_sourceY)), axis=0)
-    unique_shifted_coords = np.unique(np.column_stack((shifted_groupX, shifted_groupY)), axis=0)
-    unique_shifted_source = np.unique(np.column_stack((shifted_sourceX, shifted_sourceY)), axis=0)
+def plot_shift_result(orig_groupX, orig_groupY, orig_sourceX, orig_sourceY, x_min, y_min, output_path):
+    """绘制平移前后的对比图, 平移后的坐标由原始坐标减去偏移量(x_min, y_min)得到"""
+    # 去重处理坐标; 整体平移不改变去重结果及其排列顺序, 平移后的唯一坐标直接由原始唯一坐标平移得到
+    offset = np.array([x_min, y_min])
+    unique_orig_coords = unique_xy(orig_groupX, orig_groupY)
+    unique_orig_source = unique_xy(orig_sourceX, orig_sourceY)
+    unique_shifted_coords = unique_orig_coords - offset
+    unique_shifted_source = unique_orig_source - offset
     
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
     
     # 绘制平移前的坐标
-    ax1.scatter(unique_orig_coords[:, 0], unique_orig_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_orig_coords)})', 
-               alpha=0.5, s=10)
-    ax1.scatter(unique_orig_source[:, 0], unique_orig_source[:, 1], 
-               color='red', label=f'Sources ({len(unique_orig_source)})', 
-               alpha=0.8, s=20)
+    set_equal_limits(ax1, unique_orig_coords, unique_orig_source)
+    plot_points(ax1, unique_orig_coords, 'blue', 'Blues', label=f'Receivers ({len(unique_orig_coords)})')
+    plot_points(ax1, unique_orig_source, 'red', 'Reds',
+                label=f'Sources ({len(unique_orig_source)})', alpha=0.8, s=20)
     ax1.set_title("Before Shift")
     ax1.set_xlabel('X Coordinate')
     ax1.set_ylabel('Y Coordinate')
     ax1.legend()
     ax1.grid(True)
-    ax1.set_aspect('equal')
     
     # 绘制平移后的坐标
-    ax2.scatter(unique_shifted_coords[:, 0], unique_shifted_coords[:, 1], 
-               color='blue', label=f'Receivers ({len(unique_shifted_coords)})', 
-               alpha=0.5, s=10)
-    ax2.scatter(unique_shifted_source[:, 0], unique_shifted_source[:, 1], 
-               color='red', label=f'Sources ({len(unique_shifted_source)})', 
-               alpha=0.8, s=20)
+    set_equal_limits(ax2, unique_shifted_coords, unique_shifted_source)
+    plot_points(ax2, unique_shifted_coords, 'blue', 'Blues',
+                label=f'Receivers ({len(unique_shifted_coords)})')
+    plot_points(ax2, unique_shifted_source, 'red', 'Reds',
+                label=f'Sources ({len(unique_shifted_source)})', alpha=0.8, s=20)
     ax2.set_title("After Shift")
     ax2.set_xlabel('X Coordinate')
     ax2.set_ylabel('Y Coordinate')
     ax2.legend()
     ax2.grid(True)
-    ax2.set_aspect('equal')
     
     plt.suptitle("Coordinate Shift Result", fontsize=16)
     plt.tight_layout()
@@ -69,10 +67,28 @@ def plot_shift_result(orig_groupX, orig_groupY, orig_sourceX, orig_sourceY,
     print(f"\n坐标范围:")
     print(f"原始检波点 X: [{np.min(orig_groupX)}, {np.max(orig_groupX)}]")
     print(f"原始检波点 Y: [{np.min(orig_groupY)}, {np.max(orig_groupY)}]")
-    print(f"平移后检波点 X: [{np.min(shifted_groupX)}, {np.max(shifted_groupX)}]")
-    print(f"平移后检波点 Y: [{np.min(shifted_groupY)}, {np.max(shifted_groupY)}]")
+    print(f"平移后检波点 X: [{np.min(orig_groupX) - x_min}, {np.max(orig_groupX) - x_min}]")
+    print(f"平移后检波点 Y: [{np.min(orig_groupY) - y_min}, {np.max(orig_groupY) - y_min}]")
     print(f"对比图已保存为: {output_path}")
 
+def copy_shifted_traces(traces, new_traces, shifted_groupX, shifted_groupY, shifted_sourceX, shifted_sourceY,
+                        batch_start, batch_end, pbar):
+    """将输入道[batch_start, batch_end)复制到输出文件的相同位置, 坐标替换为平移后的坐标"""
+    batch = traces[batch_start:batch_end]
+    new_batch = new_traces[batch_start:batch_end]
+
+    # 道数据按原始字节复制, 只保留需要的header属性, 其余道头字节保持为零
+    new_batch['data'] = batch['data']
+    new_batch['source_depth'] = batch['source_depth']
+    new_batch['trace_number'] = batch['trace_number']
+    new_batch['sample_count'] = 2500
+    new_batch['sample_interval'] = batch['sample_interval']
+    new_batch['group_x'] = shifted_groupX[batch_start:batch_end]
+    new_batch['group_y'] = shifted_groupY[batch_start:batch_end]
+    new_batch['source_x'] = shifted_sourceX[batch_start:batch_end]
+    new_batch['source_y'] = shifted_sourceY[batch_start:batch_end]
+    pbar.update(batch_end - batch_start)
+
 def shift_coordinates(filename, new_filename, batch_size=100000):
     """将坐标平移到第一象限"""
     with segyio.open(filename, "r", ignore_geometry=True) as segyfile:
@@ -87,75 +103,67 @@ def shift_coordinates(filename, new_filename, batch_size=100000):
         spec.sorting = segyfile.sorting
         spec.tracecount = segyfile.tracecount
 
-        # 初始化数组
+        # 初始化数组(道头坐标为int32)
         num_traces = segyfile.tracecount
-        sourceX = np.zeros(num_traces)
-        sourceY = np.zeros(num_traces)
-        groupX = np.zeros(num_traces)
-        groupY = np.zeros(num_traces)
+        sourceX = np.empty(num_traces, dtype=np.int32)
+        sourceY = np.empty(num_traces, dtype=np.int32)
+        groupX = np.empty(num_traces, dtype=np.int32)
+        groupY = np.empty(num_traces, dtype=np.int32)
         
         # 分批读取坐标
         print("\n读取坐标...")
+        # 将道记录映射为结构化数组
+        traces = trace_memmap(filename, segyfile, KEPT_FIELDS)
         for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
             batch_end = min(batch_start + batch_size, num_traces)
-            sourceX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceX)[batch_start:batch_end]
-            sourceY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.SourceY)[batch_start:batch_end]
-            groupX[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupX)[batch_start:batch_end]
-            groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
+            # 一次取出这批道记录, 四个坐标字段从同一块内存中拆出, 道头只扫描一遍
+            batch = traces[batch_start:batch_end]
+            sourceX[batch_start:batch_end] = batch['source_x']
+            sourceY[batch_start:batch_end] = batch['source_y']
+            groupX[batch_start:batch_end] = batch['group_x']
+            groupY[batch_start:batch_end] = batch['group_y']
 
         # 计算偏移量
         x_min = np.min(groupX)
         y_min = np.min(groupY)
         print(f"\n计算得到的偏移量: ({x_min}, {y_min})")
         
-        # 进行平移
-        shifted_groupX = groupX - x_min
-        shifted_groupY = groupY - y_min
-        shifted_sourceX = sourceX - x_min
-        shifted_sourceY = sourceY - y_min
+        # 在后台进程中绘制平移前后的对比图, 与写入新的SEGY文件同时进行;
+        # 子进程以spawn方式启动, 不继承本进程中线程持有的锁, 启动时已取得坐标的副本, 下面的原地平移不影响绘图;
+        # 图片目录先在主进程中创建
+        output_fig_path = "../fig_0118/K_shift_to_origin_result.png"
+        os.makedirs(os.path.dirname(output_fig_path), exist_ok=True)
+        plot_process = get_context("spawn").Process(target=plot_shift_result,
+                                                    args=(groupX, groupY, sourceX, sourceY, x_min, y_min,
+                                                          output_fig_path))
+        plot_process.start()
         
-        # 绘制平移前后的对比图
-        plot_shift_result(groupX, groupY, sourceX, sourceY,
-                         shifted_groupX, shifted_groupY, shifted_sourceX, shifted_sourceY,
-                         "../fig_0118/K_shift_to_origin_result.png")
+        # 原地进行平移, 不再另外分配平移后的坐标数组
+        for coords, offset in ((groupX, x_min), (groupY, y_min), (sourceX, x_min), (sourceY, y_min)):
+            np.subtract(coords, offset, out=coords)
 
-        # 创建新的SEGY文件
+        # 创建新的SEGY文件, 只写入文本头和二进制头
         print("\n创建新的SEGY文件...")
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
 
-            # 批量处理
-            for batch_start in tqdm(range(0, num_traces, batch_size), desc="写入数据"):
-                batch_end = min(batch_start + batch_size, num_traces)
-                
-                # 批量读取这个批次的header属性
-                batch_headers = {
-                    'source_depth': segyfile.attributes(segyio.TraceField.SourceDepth)[batch_start:batch_end],
-                    'trace_number': segyfile.attributes(segyio.TraceField.TraceNumber)[batch_start:batch_end],
-                    'sample_count': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_start:batch_end],
-                    'sample_interval': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_start:batch_end]
-                }
-                
-                # 处理每个道
-                for i in range(batch_end - batch_start):
-                    trace_index = batch_start + i
-                    
-                    # 写入道数据
-                    new_segy.trace.raw[trace_index] = segyfile.trace.raw[trace_index]
-                    
-                    # 写入header
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: batch_headers['source_depth'][i],
-                        segyio.TraceField.TraceNumber: batch_headers['trace_number'][i],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: 2500,
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: batch_headers['sample_interval'][i],
-                        segyio.TraceField.GroupX: int(shifted_groupX[trace_index]),
-                        segyio.TraceField.GroupY: int(shifted_groupY[trace_index]),
-                        segyio.TraceField.SourceX: int(shifted_sourceX[trace_index]),
-                        segyio.TraceField.SourceY: int(shifted_sourceY[trace_index])
-                    })
+        # 输出文件的道记录也映射为结构化数组, 各批次写入互不重叠的区域, 使用线程池并行复制
+        new_traces = np.memmap(new_filename, mode="r+", offset=TRACE_DATA_OFFSET, shape=(num_traces,),
+                               dtype=traces.dtype)
+        with tqdm(total=num_traces, desc="写入数据") as pbar:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                futures = [executor.submit(copy_shifted_traces, traces, new_traces, groupX, groupY, sourceX, sourceY,
+                                           batch_start, min(batch_start + batch_size, num_traces), pbar)
+                           for batch_start in range(0, num_traces, batch_size)]
+                for future in futures:
+                    future.result()
 
+        new_traces.flush()
+        del new_traces, traces
+        plot_process.join()
+        if plot_process.exitcode != 0:
+            raise RuntimeError(f"绘图进程异常退出, 返回码 {plot_process.exitcode}")
         print(f"\n新的SEGY文件已保存为: {new_filename}")
 
 if __name__ == "__main__":
@@ -4,7 +4,7 @@
 主要步骤：
 1. 读取SEGY文件头中的采样点数
 2. 读取每一道道头中的采样点数
-3. 检查每一道的实际二进制数据长度
+3. 由文件大小计算每一道的实际二进制数据长度
 4. 检查三者是否存在不一致
 5. 输出统计信息和异常道信息
 
@@ -17,11 +17,12 @@
 - 异常道的具体信息
 """
 
+import os
 import segyio
 import numpy as np
-from tqdm import tqdm
+from segy_utils import TRACE_DATA_OFFSET, SAMPLE_FORMAT_SIZE
 
-def check_samples(filename, batch_size=100000):
+def check_samples(filename):
     """检查SEGY文件的采样点数信息和实际数据长度"""
     with segyio.open(filename, "r", ignore_geometry=True) as segyfile:
         if segyfile.mmap():
@@ -41,17 +42,16 @@ def check_samples(filename, batch_size=100000):
         
         # 分批读取每道的采样点数和实际数据
         print("\n读取道头采样点数和实际数据...")
-        trace_samples = np.zeros(num_traces, dtype=np.int32)
         actual_lengths = np.zeros(num_traces, dtype=np.int32)
         
-        for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取数据"):
-            batch_end = min(batch_start + batch_size, num_traces)
-            # 读取道头中的采样点数
-            trace_samples[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_start:batch_end]
-            
-            # 读取实际数据长度
-            for i in range(batch_start, batch_end):
-                actual_lengths[i] = len(segyfile.trace.raw[i])
+        # 每道实际数据长度由文件大小一次算出: 去掉文本头、二进制头和扩展文本头后按道数均分,
+        # 再去掉240字节道头, 按每个采样点的字节数换算, 不必逐道读取道数据
+        header_size = TRACE_DATA_OFFSET + 3200 * segyfile.ext_headers
+        bytes_per_trace = (os.path.getsize(filename) - header_size) // max(num_traces, 1)
+        actual_lengths[:] = (bytes_per_trace - 240) // SAMPLE_FORMAT_SIZE[int(segyfile.format)]
+        
+        # 一次读取全部道头中的采样点数, 整个读取过程在segyio的C代码中完成
+        trace_samples = segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[:]
         
         # 统计分析
         unique_header_samples = np.unique(trace_samples)
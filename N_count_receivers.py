@@ -14,7 +14,10 @@
 import segyio
 import numpy as np
 from tqdm import tqdm
-from collections import defaultdict
+from segy_utils import trace_memmap, pack_xy
+
+# 用到的道头字段
+HEADER_FIELDS = ['source_x', 'source_y']
 
 def count_receivers_per_shot(filename, batch_size=100000):
     """统计每个炮点的检波点数量"""
@@ -27,43 +30,35 @@ def count_receivers_per_shot(filename, batch_size=100000):
         # 获取道数
         num_traces = segyfile.tracecount
         
-        # 使用字典来存储每个炮点的检波点数量
-        shot_receiver_count = defaultdict(int)
+        # 将道记录映射为结构化数组, 分批读取时炮点X、Y从同一块道头内存中取出, 道头只扫描一遍;
+        # 炮点坐标打包为int64键作为唯一标识
+        traces = trace_memmap(filename, segyfile, HEADER_FIELDS, with_data=False)
+        source_keys = np.empty(num_traces, dtype=np.int64)
+        for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取炮点坐标"):
+            batch_end = min(batch_start + batch_size, num_traces)
+            batch = traces[batch_start:batch_end]
+            source_keys[batch_start:batch_end] = pack_xy(batch['source_x'], batch['source_y'])
+        del traces
         
-        # 分批读取所有坐标
-        num_batches = (num_traces + batch_size - 1) // batch_size
-        for batch in tqdm(range(num_batches), desc="统计检波点数量"):
-            start = batch * batch_size
-            end = min((batch + 1) * batch_size, num_traces)
-            
-            # 读取这个批次的炮点坐标
-            sourceX = segyfile.attributes(segyio.TraceField.SourceX)[start:end]
-            sourceY = segyfile.attributes(segyio.TraceField.SourceY)[start:end]
-            
-            # 将炮点坐标转换为复数作为唯一标识
-            shot_points = sourceX + 1j * sourceY
-            
-            # 统计每个炮点的检波点数量
-            for shot in shot_points:
-                shot_receiver_count[shot] += 1
+        # 一次去重计数得到每个炮点的检波点数量
+        shot_keys, receiver_counts = np.unique(source_keys, return_counts=True)
         
         # 计算统计信息
-        receiver_counts = np.array(list(shot_receiver_count.values()))
         min_receivers = np.min(receiver_counts)
         max_receivers = np.max(receiver_counts)
         avg_receivers = np.mean(receiver_counts)
         
         # 输出统计结果
         print(f"\n统计结果:")
-        print(f"总炮点数量: {len(shot_receiver_count)}")
+        print(f"总炮点数量: {len(shot_keys)}")
         print(f"检波点数量范围: {min_receivers} - {max_receivers}")
         print(f"平均检波点数量: {avg_receivers:.2f}")
         
         # 输出每个炮点的详细信息
         # print("\n每个炮点的检波点数量:")
-        # for shot, count in shot_receiver_count.items():
-        #     real_x = int(shot.real)
-        #     real_y = int(shot.imag)
+        # for key, count in zip(shot_keys, receiver_counts):
+        #     real_x = int(key >> 32)
+        #     real_y = int((key & 0xFFFFFFFF) - 2**31)
         #     print(f"炮点坐标 ({real_x}, {real_y}): {count} 个检波点")
 
 if __name__ == "__main__":
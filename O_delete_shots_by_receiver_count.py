@@ -14,26 +14,28 @@
 - 统计信息（删除前后的炮点数量等）
 """
 
+import os
 import segyio
 import numpy as np
 from tqdm import tqdm
-from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 import matplotlib.pyplot as plt
+from segy_utils import TRACE_DATA_OFFSET, KEPT_FIELDS, trace_memmap, pack_xy, unique_xy
 
 def plot_filter_result(groupX, groupY, sourceX, sourceY, 
                       keep_indices, output_path):
     """绘制过滤前后的观测系统对比图"""
     # 去重处理原始坐标
-    unique_orig_coords = np.unique(np.column_stack((groupX, groupY)), axis=0)
-    unique_orig_source = np.unique(np.column_stack((sourceX, sourceY)), axis=0)
+    unique_orig_coords = unique_xy(groupX, groupY)
+    unique_orig_source = unique_xy(sourceX, sourceY)
     
     # 获取过滤后的坐标并去重
     filtered_sourceX = sourceX[keep_indices]
     filtered_sourceY = sourceY[keep_indices]
     filtered_groupX = groupX[keep_indices]
     filtered_groupY = groupY[keep_indices]
-    unique_filtered_coords = np.unique(np.column_stack((filtered_groupX, filtered_groupY)), axis=0)
-    unique_filtered_source = np.unique(np.column_stack((filtered_sourceX, filtered_sourceY)), axis=0)
+    unique_filtered_coords = unique_xy(filtered_groupX, filtered_groupY)
+    unique_filtered_source = unique_xy(filtered_sourceX, filtered_sourceY)
     
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(20, 10))
     
@@ -75,6 +77,29 @@ def plot_filter_result(groupX, groupY, sourceX, sourceY,
     print(f"炮点数量: {len(unique_orig_source)} -> {len(unique_filtered_source)}")
     print(f"对比图已保存为: {output_path}")
 
+def copy_kept_traces(traces, new_traces, keep_indices, groupX, groupY, sourceX, sourceY,
+                     batch_start, batch_end, pbar):
+    """将keep_indices[batch_start:batch_end]指向的输入道复制到输出文件[batch_start, batch_end)"""
+    batch_indices = keep_indices[batch_start:batch_end]
+    # 保留的道在输入中连续时直接从映射切片复制, 省去一次整条道记录的临时拷贝
+    if np.all(np.diff(batch_indices) == 1):
+        kept = traces[batch_indices[0]:batch_indices[-1] + 1]
+    else:
+        kept = traces[batch_indices]
+    new_batch = new_traces[batch_start:batch_end]
+
+    # 道数据按原始字节复制, 只写入需要的header属性, 其余道头字节保持为零
+    new_batch['data'] = kept['data']
+    new_batch['source_depth'] = kept['source_depth']
+    new_batch['trace_number'] = kept['trace_number']
+    new_batch['sample_count'] = kept['sample_count']
+    new_batch['sample_interval'] = kept['sample_interval']
+    new_batch['group_x'] = groupX[batch_indices]
+    new_batch['group_y'] = groupY[batch_indices]
+    new_batch['source_x'] = sourceX[batch_indices]
+    new_batch['source_y'] = sourceY[batch_indices]
+    pbar.update(batch_end - batch_start)
+
 def delete_shots_by_receiver_count(filename, new_filename, max_receivers, batch_size=100000):
     """删除检波点数量超过阈值的炮点"""
     with segyio.open(filename, "r", ignore_geometry=True) as segyfile:
@@ -86,52 +111,24 @@ def delete_shots_by_receiver_count(filename, new_filename, max_receivers, batch_
         # 获取道数
         num_traces = segyfile.tracecount
         
-        # 初始化数组存储所有坐标
-        sourceX_all = np.zeros(num_traces)
-        sourceY_all = np.zeros(num_traces)
-        groupX_all = np.zeros(num_traces)
-        groupY_all = np.zeros(num_traces)
-        
-        # 使用字典来存储每个炮点的检波点数量
-        shot_receiver_count = defaultdict(int)
+        # 一次读取全部坐标, 整个读取过程在segyio的C代码中完成
+        sourceX_all = segyfile.attributes(segyio.TraceField.SourceX)[:]
+        sourceY_all = segyfile.attributes(segyio.TraceField.SourceY)[:]
+        groupX_all = segyfile.attributes(segyio.TraceField.GroupX)[:]
+        groupY_all = segyfile.attributes(segyio.TraceField.GroupY)[:]
         
-        # 第一次遍历：统计每个炮点的检波点数量
+        # 第一步：炮点坐标打包为int64键, 一次去重计数得到每个炮点的检波点数量
         print("\n第一步：统计每个炮点的检波点数量")
-        num_batches = (num_traces + batch_size - 1) // batch_size
-        for batch in tqdm(range(num_batches), desc="读取坐标"):
-            start = batch * batch_size
-            end = min((batch + 1) * batch_size, num_traces)
-            
-            # 读取这个批次的坐标
-            sourceX = segyfile.attributes(segyio.TraceField.SourceX)[start:end]
-            sourceY = segyfile.attributes(segyio.TraceField.SourceY)[start:end]
-            groupX = segyfile.attributes(segyio.TraceField.GroupX)[start:end]
-            groupY = segyfile.attributes(segyio.TraceField.GroupY)[start:end]
-            
-            # 存储坐标
-            sourceX_all[start:end] = sourceX
-            sourceY_all[start:end] = sourceY
-            groupX_all[start:end] = groupX
-            groupY_all[start:end] = groupY
-            
-            # 统计检波点数量
-            shot_points = sourceX + 1j * sourceY
-            for shot in shot_points:
-                shot_receiver_count[shot] += 1
+        # 同时记录每道所属炮点的序号, 计数只占每个炮点8字节
+        shot_keys, shot_ids, receiver_counts = np.unique(pack_xy(sourceX_all, sourceY_all),
+                                                         return_inverse=True, return_counts=True)
         
         # 找出需要保留的炮点
-        valid_shots = {shot for shot, count in shot_receiver_count.items() 
-                      if count <= max_receivers}
+        valid_shots = receiver_counts <= max_receivers
         
-        # 第二次遍历：找出要保留的道
+        # 第二步：按每道所属炮点的序号取出是否保留, 找出要保留的道
         print("\n第二步：筛选符合条件的道")
-        keep_indices = []
-        for i in range(num_traces):
-            shot = sourceX_all[i] + 1j * sourceY_all[i]
-            if shot in valid_shots:
-                keep_indices.append(i)
-        
-        keep_indices = np.array(keep_indices)
+        keep_indices = np.flatnonzero(valid_shots[shot_ids])
         
         # 创建输出文件的规格
         spec = segyio.spec()
@@ -144,44 +141,27 @@ def delete_shots_by_receiver_count(filename, new_filename, max_receivers, batch_
         plot_filter_result(groupX_all, groupY_all, sourceX_all, sourceY_all, 
                          keep_indices, "../fig_0118/O_receiver_count_filter_result.png")
         
-        # 创建新的SEGY文件并写入数据
         print("\n第三步：写入新文件")
+        # 创建新的SEGY文件, 只写入文本头和二进制头
         with segyio.create(new_filename, spec) as new_segy:
             new_segy.text[0] = segyfile.text[0]
             new_segy.bin = segyfile.bin
-            
-            # 批量处理
-            for batch_start in tqdm(range(0, len(keep_indices), batch_size), desc="写入数据"):
-                batch_end = min(batch_start + batch_size, len(keep_indices))
-                batch_indices = keep_indices[batch_start:batch_end]
-                
-                # 批量读取这个批次的header属性
-                batch_headers = {
-                    'source_depth': segyfile.attributes(segyio.TraceField.SourceDepth)[batch_indices],
-                    'trace_number': segyfile.attributes(segyio.TraceField.TraceNumber)[batch_indices],
-                    'sample_count': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[batch_indices],
-                    'sample_interval': segyfile.attributes(segyio.TraceField.TRACE_SAMPLE_INTERVAL)[batch_indices]
-                }
-                
-                # 一次性更新这个批次的所有header
-                for i in range(len(batch_indices)):
-                    trace_index = batch_start + i
-                    orig_index = batch_indices[i]
-                    
-                    # 读取并写入道数据
-                    new_segy.trace.raw[trace_index] = segyfile.trace.raw[orig_index]
-                    
-                    # 写入header
-                    new_segy.header[trace_index].update({
-                        segyio.TraceField.SourceDepth: batch_headers['source_depth'][i],
-                        segyio.TraceField.TraceNumber: batch_headers['trace_number'][i],
-                        segyio.TraceField.TRACE_SAMPLE_COUNT: batch_headers['sample_count'][i],
-                        segyio.TraceField.TRACE_SAMPLE_INTERVAL: batch_headers['sample_interval'][i],
-                        segyio.TraceField.GroupX: int(groupX_all[orig_index]),
-                        segyio.TraceField.GroupY: int(groupY_all[orig_index]),
-                        segyio.TraceField.SourceX: int(sourceX_all[orig_index]),
-                        segyio.TraceField.SourceY: int(sourceY_all[orig_index])
-                    })
+
+        # 输入、输出文件的道记录都映射为结构化数组, 各批次写入互不重叠的区域, 使用线程池并行复制
+        traces = trace_memmap(filename, segyfile, KEPT_FIELDS)
+        new_traces = np.memmap(new_filename, mode="r+", offset=TRACE_DATA_OFFSET, shape=(len(keep_indices),),
+                               dtype=traces.dtype)
+        with tqdm(total=len(keep_indices), desc="写入数据") as pbar:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                futures = [executor.submit(copy_kept_traces, traces, new_traces, keep_indices,
+                                           groupX_all, groupY_all, sourceX_all, sourceY_all,
+                                           batch_start, min(batch_start + batch_size, len(keep_indices)), pbar)
+                           for batch_start in range(0, len(keep_indices), batch_size)]
+                for future in futures:
+                    future.result()
+
+        new_traces.flush()
+        del new_traces, traces
         
         print(f"\n新的SEGY文件已保存为: {new_filename}")
 
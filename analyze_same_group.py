@@ -17,41 +17,27 @@
 """
 
 import segyio
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from tqdm import tqdm
 
-def analyze_segy_files(filenames, batch_size=100000):
-    all_source_coords = []
-    all_group_coords = []
+def analyze_segy_files(filenames):
+    coords = {'sx': [], 'sy': [], 'gx': [], 'gy': []}
     
     # 读取SEGY文件并提取坐标
     for filename in filenames:
         with segyio.open(filename, ignore_geometry=True) as segyfile:
-            sourceX = segyfile.attributes(segyio.TraceField.SourceX)
-            sourceY = segyfile.attributes(segyio.TraceField.SourceY)
-            groupX = segyfile.attributes(segyio.TraceField.GroupX)  
-            groupY = segyfile.attributes(segyio.TraceField.GroupY)
-            
-            num_traces = segyfile.tracecount
-            num_batches = (num_traces + batch_size - 1) // batch_size
-            
-            for batch in tqdm(range(num_batches), desc=f"Processing {filename}"):
-                start = batch * batch_size
-                end = min((batch + 1) * batch_size, num_traces)
-                
-                all_source_coords.extend(zip(sourceX[start:end], sourceY[start:end]))
-                all_group_coords.extend(zip(groupX[start:end], groupY[start:end]))
+            # 一次读取全部坐标, 整个读取过程在segyio的C代码中完成
+            coords['sx'].append(segyfile.attributes(segyio.TraceField.SourceX)[:])
+            coords['sy'].append(segyfile.attributes(segyio.TraceField.SourceY)[:])
+            coords['gx'].append(segyfile.attributes(segyio.TraceField.GroupX)[:])
+            coords['gy'].append(segyfile.attributes(segyio.TraceField.GroupY)[:])
                 
     print("for loop end")
     
-    # 创建DataFrame  
-    df = pd.DataFrame({
-        'sx': [coord[0] for coord in all_source_coords],
-        'sy': [coord[1] for coord in all_source_coords],
-        'gx': [coord[0] for coord in all_group_coords],
-        'gy': [coord[1] for coord in all_group_coords]
-    })
+    # 创建DataFrame, 各文件的坐标数组直接拼接为列, 不经过逐道的Python元组
+    df = pd.DataFrame({name: np.concatenate(arrays) for name, arrays in coords.items()})
     print("df created")
     
     # 去重
@@ -61,11 +47,12 @@ def analyze_segy_files(filenames, batch_size=100000):
     # 创建字典以存储检波点集合和对应的炮点集合
     group_to_sources = {}
 
-    # 遍历去重后的炮点集合
-    for source in tqdm(unique_source_coords.itertuples(index=False), total=len(unique_source_coords)):
-        sx, sy = source.sx, source.sy
+    # 按炮点分组, 一次遍历得到每个炮点对应的所有检波点, 不再对每个炮点重新扫描整个表
+    # (sort=False按炮点首次出现的顺序分组, 与去重后炮点的顺序一致)
+    source_groups = df.groupby(['sx', 'sy'], sort=False)[['gx', 'gy']]
+    for (sx, sy), groups in tqdm(source_groups, total=len(unique_source_coords)):
         # 获取当前炮点对应的所有检波点
-        corresponding_groups = df[(df['sx'] == sx) & (df['sy'] == sy)][['gx', 'gy']].drop_duplicates()
+        corresponding_groups = groups.drop_duplicates()
         group_set = frozenset(map(tuple, corresponding_groups.values))  # 使用 frozenset 作为字典的键
         if group_set not in group_to_sources:
             group_to_sources[group_set] = set()
@@ -107,4 +94,4 @@ filenames = [
     # '../data/SHOT_200065.SGY',
 ]
 
-analyze_segy_files(filenames,batch_size=32) 
\ No newline at end of file
+analyze_segy_files(filenames) 
\ No newline at end of file
@@ -31,17 +31,13 @@ def print_unique_receiver_y(segy_file, batch_size=100000):
         print(f"\n文件信息:")
         print(f"总道数: {num_traces}")
         
-        # 初始化数组
+        # 分批读取Y坐标, 每批去重后并入已排序的唯一值, 内存只随唯一值个数增长
         print("\n读取Y坐标...")
-        groupY = np.zeros(num_traces)
-        
-        # 分批读取Y坐标
+        groupY = segyfile.attributes(segyio.TraceField.GroupY)
+        unique_y = np.empty(0, dtype=np.int32)
         for batch_start in tqdm(range(0, num_traces, batch_size), desc="读取坐标"):
             batch_end = min(batch_start + batch_size, num_traces)
-            groupY[batch_start:batch_end] = segyfile.attributes(segyio.TraceField.GroupY)[batch_start:batch_end]
-        
-        # 获取唯一的Y坐标并排序
-        unique_y = np.unique(groupY)
+            unique_y = np.union1d(unique_y, groupY[batch_start:batch_end])
         
         print(f"\n去重后的Y坐标数组 ({len(unique_y)} 个):")
         print(f"y_coords = [{', '.join(map(str, unique_y.astype(int)))}]")
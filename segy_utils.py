@@ -0,0 +1,149 @@
+"""
+各脚本共用的SEG-Y道记录读写和坐标工具。
+
+1. 道记录按结构化dtype整体映射: 只声明用到的道头字段, 其余道头字节作为填充,
+   道数据作为不解码的原始字节, 各字段以跨道步长的视图按批次向量化读写。
+2. 整数坐标对打包为int64键, 坐标的去重、比较和查找都在一维键上进行。
+3. 坐标点分布图的绘制: 点数多时改为栅格或抽稀绘制, 坐标轴范围一次性设定。
+"""
+
+import os
+import mmap
+import segyio
+import numpy as np
+
+# 3200字节文本头 + 400字节二进制头
+TRACE_DATA_OFFSET = 3600
+
+# 各数据格式每个采样点所占字节数
+SAMPLE_FORMAT_SIZE = {1: 4, 2: 4, 3: 2, 5: 4, 6: 8, 8: 1, 9: 8, 10: 4, 11: 2, 12: 8, 16: 1}
+
+# 道头字段: 名称 -> (字节位置, 大端数据类型), 各脚本按名称选用
+# header为完整的240字节道头, 与其余字段重叠
+TRACE_FIELDS = {
+    'header': (1, 'V240'),
+    'source_depth': (segyio.TraceField.SourceDepth, '>i4'),
+    'trace_number': (segyio.TraceField.TraceNumber, '>i4'),
+    'sample_count': (segyio.TraceField.TRACE_SAMPLE_COUNT, '>i2'),
+    'sample_interval': (segyio.TraceField.TRACE_SAMPLE_INTERVAL, '>i2'),
+    'group_x': (segyio.TraceField.GroupX, '>i4'),
+    'group_y': (segyio.TraceField.GroupY, '>i4'),
+    'source_x': (segyio.TraceField.SourceX, '>i4'),
+    'source_y': (segyio.TraceField.SourceY, '>i4'),
+}
+
+# 炮点和检波点坐标字段
+COORD_FIELDS = ['source_x', 'source_y', 'group_x', 'group_y']
+
+# 处理后的SEGY文件中保留的道头字段, 其余道头字节置零
+KEPT_FIELDS = ['source_depth', 'trace_number', 'sample_count', 'sample_interval',
+               'group_x', 'group_y', 'source_x', 'source_y']
+
+def trace_dtype(num_samples, sample_format, header_fields, with_data=True):
+    """
+    构造与一条SEG-Y道记录(240字节道头 + 道数据)等长的大端结构化dtype
+    header_fields: 用到的道头字段名称列表(见TRACE_FIELDS), 其余道头字节作为填充
+    with_data: 为True时道数据声明为不解码的原始字节字段'data'
+    """
+    data_size = num_samples * SAMPLE_FORMAT_SIZE[int(sample_format)]
+    names = list(header_fields)
+    formats = [TRACE_FIELDS[name][1] for name in names]
+    offsets = [TRACE_FIELDS[name][0] - 1 for name in names]
+    if with_data:
+        names.append('data')
+        formats.append(f'V{data_size}')
+        offsets.append(240)
+    return np.dtype({'names': names, 'formats': formats, 'offsets': offsets, 'itemsize': 240 + data_size})
+
+def trace_memmap(filename, segyfile, header_fields, with_data=True, sequential=False):
+    """
+    将SEGY文件的全部道记录只读映射为结构化数组
+    sequential: 为True时提示内核道记录将按顺序批量扫描, 加大预读窗口并尽早回收已读过的页
+    """
+    dtype = trace_dtype(len(segyfile.samples), segyfile.format, header_fields, with_data)
+    offset = os.path.getsize(filename) - segyfile.tracecount * dtype.itemsize
+    if not sequential:
+        return np.memmap(filename, dtype=dtype, mode="r", offset=offset, shape=(segyfile.tracecount,))
+    # 自行映射整个文件, 以便对映射对象调用madvise, 再在其上构造结构化数组
+    with open(filename, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if hasattr(mmap, 'MADV_SEQUENTIAL'):
+        buffer.madvise(mmap.MADV_SEQUENTIAL)
+    return np.frombuffer(buffer, dtype=dtype, count=segyfile.tracecount, offset=offset)
+
+def release_page_cache(filename):
+    """文件已完整读完后通知内核丢弃其页缓存, 避免连续处理多个大文件时挤占内存"""
+    if hasattr(os, 'posix_fadvise'):
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+def pack_xy(x, y):
+    """
+    将整数值坐标对(x, y)打包为int64键, 高32位为x, 低32位为y + 2**31,
+    键的大小顺序与(x, y)的字典序一致; 浮点坐标按写入道头时的方式向零截断取整
+    """
+    return (np.asarray(x, dtype=np.int64) << 32) | (np.asarray(y, dtype=np.int64) + 2**31)
+
+def unpack_xy(keys):
+    """将pack_xy打包的int64键还原为(M, 2)的int32坐标数组"""
+    return np.column_stack((keys >> 32, (keys & 0xFFFFFFFF) - 2**31)).astype(np.int32)
+
+def unique_xy(x, y, return_inverse=False):
+    """
+    对整数值坐标对去重, 结果与np.unique(np.column_stack((x, y)), axis=0)相同
+    (按x、y字典序排列, 保持输入的数据类型)
+    打包为int64键后做一维去重, 代替按行的二维字典序排序
+    """
+    keys = pack_xy(x, y)
+    if return_inverse:
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+    else:
+        unique_keys = np.unique(keys)
+    coords = unpack_xy(unique_keys).astype(np.result_type(x, y))
+    return (coords, inverse) if return_inverse else coords
+
+def thin_points(coords, max_points=500000):
+    """
+    返回用于散点绘制的(x, y), 点数超过max_points时固定随机种子均匀抽稀,
+    图上的整体分布基本不变, 绘制时间和内存不再随点数线性增长
+    """
+    if len(coords) > max_points:
+        coords = coords[np.sort(np.random.default_rng(0).choice(len(coords), max_points, replace=False))]
+    return coords[:, 0], coords[:, 1]
+
+def plot_points(ax, coords, color, cmap, label=None, alpha=0.5, s=10, marker='o', max_points=200000):
+    """
+    绘制坐标点分布: 点数不超过max_points时逐点散点绘制,
+    超过时改用二维直方图栅格绘制, 绘制时间只随栅格像素数而不随点数增长
+    """
+    if len(coords) <= max_points:
+        ax.scatter(coords[:, 0], coords[:, 1], color=color, label=label,
+                   alpha=alpha, s=s, marker=marker, rasterized=True)
+        return
+    # 网格数随点数增长, 上限1024
+    bins = int(np.clip(2 * np.sqrt(len(coords)), 64, 1024))
+    counts, xedges, yedges = np.histogram2d(coords[:, 0], coords[:, 1], bins=bins)
+    # 下限取负值, 使只含一个点的格子也呈明显的颜色
+    ax.imshow(np.ma.masked_equal(counts.T, 0), extent=[xedges[0], xedges[-1], yedges[0], yedges[-1]],
+              origin='lower', cmap=cmap, vmin=-counts.max(), vmax=counts.max(), interpolation='nearest')
+    # 栅格图不进入图例, 添加一个空散点作为图例项
+    if label is not None:
+        ax.scatter([], [], color=color, label=label, s=s, marker=marker)
+
+def set_equal_limits(ax, *coord_sets):
+    """
+    由要绘制的全部坐标点集一次性设定坐标轴范围(两侧各留5%), 并按等比例显示,
+    各图层绘制时不再逐层重新计算数据范围; 等比例通过调整坐标区形状实现, 设定的x、y范围都保持不变
+    """
+    coord_sets = [coords for coords in coord_sets if len(coords)]
+    if not coord_sets:
+        return
+    lower = np.min([coords.min(axis=0) for coords in coord_sets], axis=0).astype(float)
+    upper = np.max([coords.max(axis=0) for coords in coord_sets], axis=0).astype(float)
+    margin = np.where(upper > lower, (upper - lower) * 0.05, 1.0)
+    ax.set_xlim(lower[0] - margin[0], upper[0] + margin[0])
+    ax.set_ylim(lower[1] - margin[1], upper[1] + margin[1])
+    ax.set_aspect('equal', adjustable='box')
@@ -2,33 +2,71 @@
 此脚本用于动态展示 SEGY 格式炮集数据中每个炮点及其对应的检波点的空间分布。通过动画,可以观察每个炮点和其检波点的关系,有助于理解地震数据的采集布局。
 
 主要功能：
-1. 从SEGY文件中读取炮点(SourceX, SourceY)和检波点(GroupX, GroupY)的坐标。
-2. 将坐标存储在Pandas DataFrame中,便于处理和过滤。
+1. 从SEGY文件中读取炮点(SourceX, SourceY)和检波点(GroupX, GroupY)的坐标,结果缓存在SEGY文件旁的.shot_coords.npz文件中,再次运行时直接加载。
+2. 将坐标存储在NumPy数组中,按炮点排序后取出每帧炮点对应的检波点。
 3. 提取所有独特的炮点,并按Y和X坐标排序,确保动画展示的顺序从左上角到右下角。
-4. 使用matplotlib和matplotlib.animation创建动画,展示每个炮点及其相应的检波点。
+4. 使用matplotlib逐帧绘制,展示每个炮点及其相应的检波点。
 5. 动画中,所有炮点和检波点以不同颜色标记,当前活跃的炮点和检波点以特殊颜色和符号突出显示。
-6. 动画保存为GIF文件,方便展示和分享。
+6. 各帧由Pillow合成为GIF文件,或经ffmpeg编码为MP4视频,方便展示和分享。
 
 参数说明：
-- filename: 要处理的SEGY文件的路径。
-- batch_size: 每批次处理的道数,默认为100000。
+- filenames: 要处理的SEGY文件路径列表。
+- output_file: 输出动画路径, 后缀为.gif时由Pillow写出GIF, 为.mp4时调用ffmpeg编码为H.264视频。
 
 输出：
-- 动画GIF文件,展示了每个炮点及其检波点的变化过程。
+- 动画GIF(或MP4)文件,展示了每个炮点及其检波点的变化过程。
 """
 
+import os
+import subprocess
 import segyio
 import matplotlib.pyplot as plt
-import matplotlib.animation as animation
-import pandas as pd
+import numpy as np
+from PIL import Image
 from tqdm import tqdm
+from segy_utils import COORD_FIELDS, trace_memmap, pack_xy, unique_xy
 
-def process_segy_file(filenames, batch_size=100000):
-    unique_source_coords = set()
-    unique_group_coords = set()
-    df_list = []  # 用于存储每个批次的DataFrame
+def read_trace_coords(filename, segyfile):
+    """
+    返回每道的炮点、检波点坐标(sourceX, sourceY, groupX, groupY), 缓存在filename旁的.shot_coords.npz文件中,
+    缓存不早于SEGY文件且记录的道数、文件大小与当前文件一致时直接加载, 否则扫描道头并写入缓存
+    """
+    cache = filename + '.shot_coords.npz'
+    file_size = os.path.getsize(filename)
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(filename):
+        with np.load(cache) as coords:
+            # SEGY文件可能被保留了较早修改时间的副本替换, 缓存未记录道数和文件大小或与当前文件不符时重新扫描
+            if ('tracecount' in coords.files and coords['tracecount'] == segyfile.tracecount
+                    and coords['file_size'] == file_size):
+                sourceX, sourceY, groupX, groupY = coords['sx'], coords['sy'], coords['gx'], coords['gy']
+                assert all(len(values) == segyfile.tracecount for values in (sourceX, sourceY, groupX, groupY))
+                return sourceX, sourceY, groupX, groupY
+
+    # 将道记录映射为结构化数组, 一次按步长取出整个文件的炮点和检波点坐标
+    traces = trace_memmap(filename, segyfile, COORD_FIELDS, with_data=False)
+    sourceX = traces['source_x'].astype(np.int32)
+    sourceY = traces['source_y'].astype(np.int32)
+    groupX = traces['group_x'].astype(np.int32)
+    groupY = traces['group_y'].astype(np.int32)
+    del traces
+    try:
+        np.savez(cache, sx=sourceX, sy=sourceY, gx=groupX, gy=groupY,
+                 tracecount=segyfile.tracecount, file_size=file_size)
+    except OSError:
+        # 缓存写入失败不影响绘图
+        pass
+    return sourceX, sourceY, groupX, groupY
+
+def process_segy_file(filenames, output_file="../fig_0118/M_shot_test.SEGY.gif"):
+    # 先统计所有文件的总道数, 预先分配坐标数组, 各文件的坐标直接写入其中
+    num_traces = 0
+    for filename in filenames:
+        with segyio.open(filename, ignore_geometry=True) as segyfile:
+            num_traces += segyfile.tracecount
+    coords = np.empty((num_traces, 4), dtype=np.int32)
 
     # 读取SEGY文件并提取坐标
+    start = 0
     for filename in filenames:
         with segyio.open(filename, ignore_geometry=True) as segyfile:
             # 使用内存映射
@@ -37,78 +75,99 @@ def process_segy_file(filenames, batch_size=100000):
             else:
                 print(f"\nMemory mapping failed for {filename}!")
 
-            num_traces = segyfile.tracecount
-            num_batches = (num_traces + batch_size - 1) // batch_size
-            
-            for batch in tqdm(range(num_batches), desc="Processing batches"):
-                start = batch * batch_size
-                end = min((batch + 1) * batch_size, num_traces)
-                
-                # 提取当前批次的炮点坐标并去重
-                sourceX = segyfile.attributes(segyio.TraceField.SourceX)[start:end]
-                sourceY = segyfile.attributes(segyio.TraceField.SourceY)[start:end]
-                unique_source_coords.update(set(zip(sourceX, sourceY)))
-                
-                # 提取当前批次的检波器坐标
-                groupX = segyfile.attributes(segyio.TraceField.GroupX)[start:end]
-                groupY = segyfile.attributes(segyio.TraceField.GroupY)[start:end]
-                unique_group_coords.update(set(zip(groupX, groupY)))
-                
-                # 创建当前批次的DataFrame并添加到列表中
-                batch_df = pd.DataFrame({
-                    'sx': sourceX,
-                    'sy': sourceY,
-                    'gx': groupX,
-                    'gy': groupY
-                })
-                df_list.append(batch_df)
-        
-    # 合并所有批次的DataFrame
-    all_gx_gy = pd.concat(df_list, ignore_index=True)
-    
-    # 将炮点坐标转换为DataFrame并排序
-    unique_sx_sy = pd.DataFrame(list(unique_source_coords), columns=['sx', 'sy'])
-    unique_sx_sy = unique_sx_sy.sort_values(by=['sy', 'sx'], ascending=[False, True]).reset_index(drop=True)
-    unique_gx_gy = pd.DataFrame(list(unique_group_coords), columns=['gx', 'gy'])
-    
-    # 创建一个图形和轴对象
-    fig, ax = plt.subplots(figsize=(16, 13))
+            end = start + segyfile.tracecount
+            for column, values in enumerate(read_trace_coords(filename, segyfile)):
+                coords[start:end, column] = values
+            start = end
+
+    # 炮点和检波器坐标去重, 炮点按Y降序、X升序排列
+    source_coords = unique_xy(coords[:, 0], coords[:, 1])
+    source_coords = source_coords[np.lexsort((source_coords[:, 0], -source_coords[:, 1].astype(np.int64)))]
+    group_coords = unique_xy(coords[:, 2], coords[:, 3])
+
     # 设置步长
     step = 3 # 每隔step个炮点选择一个进行动画展示
-    # 创建动画对象
-    frames = range(0, len(unique_sx_sy), step)
-    pbar = tqdm(total=len(frames), desc="Creating animation")  # 创建进度条
+    # 参与动画的炮点帧
+    frames = range(0, len(source_coords), step)
+
+    # 渲染前一次性取出各帧炮点对应的检波点: 按炮点键对道做稳定排序(保持道的原有顺序),
+    # 二分查找每帧炮点所在的区间, 只为参与动画的炮点生成检波点数组
+    source_keys = pack_xy(coords[:, 0], coords[:, 1])
+    order = np.argsort(source_keys, kind='stable')
+    sorted_keys = source_keys[order]
+    frame_keys = pack_xy(source_coords[::step, 0], source_coords[::step, 1])
+    starts = np.searchsorted(sorted_keys, frame_keys, side='left')
+    ends = np.searchsorted(sorted_keys, frame_keys, side='right')
+    frame_receivers = {frame: coords[order[start:end], 2:] for frame, start, end in zip(frames, starts, ends)}
+    del coords, source_keys, order, sorted_keys
     
-    # 动画更新函数
+    # 创建一个图形和轴对象
+    fig, ax = plt.subplots(figsize=(8, 6.5), dpi=80)  # 每帧640×520像素, 概览足够清晰且渲染、编码更快
+    
+    # 所有检波点和坐标轴为静态底图; 当前检波点及压在其上的所有炮点、当前炮点、图例和标题为动画图层,
+    # 逐帧按原来的先后顺序绘制
+    ax.scatter(group_coords[:, 0], group_coords[:, 1], color='blue', label='All Receivers', alpha=1)  # 显示所有检波点
+    cur_recv = ax.scatter([], [], marker='*', color='yellow', label='Current Receivers', animated=True)  # 当前炮点对应的检波点
+    all_src = ax.scatter(source_coords[:, 0], source_coords[:, 1], color='green', label='All Sources', alpha=1, animated=True)  # 显示所有炮点
+    cur_src = ax.scatter([], [], color='red', marker='o', label='Current Source', animated=True)  # 当前活跃炮点
+    ax.set_xlabel('X Coordinate')
+    ax.set_ylabel('Y Coordinate')
+    title = ax.set_title('', animated=True)
+    legend = ax.legend()
+    legend.set_animated(True)
+    # 保证xy轴单位长度相等
+    ax.set_aspect('equal')
+
+    # 动画更新函数:每帧只更新当前炮点、当前检波点和标题
     def update(frame):
         # 获取当前 (sx, sy) 点
-        sx, sy = unique_sx_sy.iloc[frame]
-        # 提取与当前 (sx, sy) 对应的所有 (gx, gy) 点
-        filtered_gx_gy = all_gx_gy[(all_gx_gy['sx'] == sx) & (all_gx_gy['sy'] == sy)]
-        # 清空轴,以便绘制新的图形
-        ax.clear()
-        # 绘制当前 (sx, sy) 和对应的 (gx, gy) 点
-        ax.scatter(unique_gx_gy['gx'], unique_gx_gy['gy'], color='blue', label='All Receivers', alpha=1)  # 显示所有检波点
-        ax.scatter(filtered_gx_gy['gx'], filtered_gx_gy['gy'], marker='*', color='yellow', label='Current Receivers')  # 显示当前炮点对应的检波点
-        ax.scatter(unique_sx_sy['sx'], unique_sx_sy['sy'], color='green', label='All Sources', alpha=1)  # 显示所有炮点
-        ax.scatter(sx, sy, color='red', marker='o', label='Current Source')  # 显示当前活跃炮点
-        # 设置图形的标签和标题
-        ax.set_xlabel('X Coordinate')
-        ax.set_ylabel('Y Coordinate')
-        ax.set_title(f"Source Point: ({sx}, {sy}) and its Receivers")
-        ax.legend()
-        # 保证xy轴单位长度相等
-        ax.set_aspect('equal')
-        # 更新进度条
-        pbar.update(1)
-    
-    ani = animation.FuncAnimation(fig, update, frames=frames, interval=1000, repeat=False)
-    # 保存动画为GIF
-    ani.save('../fig_0118/M_shot_test.SEGY.gif', writer='pillow', fps=1)
+        sx, sy = source_coords[frame]
+        # 与当前 (sx, sy) 对应的所有 (gx, gy) 点
+        cur_recv.set_offsets(frame_receivers[frame])
+        cur_src.set_offsets([[sx, sy]])
+        title.set_text(f"Source Point: ({sx}, {sy}) and its Receivers")
+
+    # 先绘制一次不含动画图层的底图并缓存, 每帧恢复底图后只绘制动画图层
+    fig.canvas.draw()
+    background = fig.canvas.copy_from_bbox(fig.bbox)
+    height, width, _ = np.asarray(fig.canvas.buffer_rgba()).shape
+
+    def render_frames():
+        """逐帧更新并绘制动画图层, 依次返回整幅图像的RGBA缓冲"""
+        for frame in tqdm(frames, desc="Creating animation"):
+            update(frame)
+            fig.canvas.restore_region(background)
+            for artist in (cur_recv, all_src, cur_src, legend, title):
+                ax.draw_artist(artist)
+            yield fig.canvas.buffer_rgba()
+
+    if output_file.endswith('.mp4'):
+        # 逐帧以原始RGBA数据写入ffmpeg的标准输入, 编码为H.264视频, 每帧1秒
+        ffmpeg = subprocess.Popen([plt.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+                                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', f'{width}x{height}', '-r', '1', '-i', '-',
+                                   '-c:v', 'libx264', '-pix_fmt', 'yuv420p', '-b:v', '2000k', output_file],
+                                  stdin=subprocess.PIPE)
+        for buffer in render_frames():
+            ffmpeg.stdin.write(buffer)
+        ffmpeg.stdin.close()
+        plt.close(fig)
+        if ffmpeg.wait() != 0:
+            raise RuntimeError(f"ffmpeg编码失败, 返回码 {ffmpeg.returncode}")
+        return
+
+    # 逐帧渲染为调色板图像, 以生成器交给Pillow边渲染边写出GIF, 不再先在内存中保存所有整帧图像
+    images = (Image.fromarray(np.asarray(buffer)).convert('RGB').convert('P', palette=Image.Palette.ADAPTIVE)
+              for buffer in render_frames())
+
+    # 保存动画为GIF,每帧1秒
+    next(images).save(output_file, save_all=True, append_images=images,
+                      duration=1000, loop=0, optimize=True)
+    plt.close(fig)
 
 # 文件名设置
 filenames = [
     "../result_0118/M_shot_test.SEGY",
 ]
+output_file = "../fig_0118/M_shot_test.SEGY.gif"  # 改为.mp4后缀时用ffmpeg编码为H.264视频, 文件更小、编码更快
 
-process_segy_file(filenames, batch_size=100000)
+process_segy_file(filenames, output_file)
@@ -2,7 +2,7 @@
 此脚本用于可视化 SEGY 格式炮集数据中炮点和检波点坐标,分析和理解地震数据采集的空间分布。
 
 主要功能：
-1. 从多个SEGY文件中读取炮点和检波点的X和Y坐标。
+1. 从多个SEGY文件中读取炮点和检波点的X和Y坐标,去重结果缓存在SEGY文件旁的.unique_coords.npz文件中,再次运行时直接加载。
 2. 利用 matplotlib 库绘制这些坐标,其中检波点的颜色表示叠加道数,提供了关于数据厚度的视觉信息。
 3. 炮点以红色标记,检波点根据其叠加道数使用色谱进行着色。
 4. 图表包含标题、坐标轴标签、图例和网格,以增强信息的清晰度和可读性。
@@ -10,27 +10,51 @@
 
 参数：
 - filenames: SEGY文件路径列表。
-- batch_size: 每批次处理的道数,默认为100000。
 
 输出：
 - 图形文件保存在指定位置。
 - 控制台输出包括每个文件的地震道数量、采样点数量等统计信息。
 """
 
+import os
 import segyio
 import matplotlib.pyplot as plt
 import numpy as np
-from tqdm import tqdm
+from segy_utils import COORD_FIELDS, trace_memmap, unique_xy
 
-def process_segy_file(filenames, batch_size=100000):
+def read_unique_coords(filename, segyfile):
+    """
+    返回去重后的炮点坐标和检波点坐标(各为N×2数组), 缓存在filename旁的.unique_coords.npz文件中,
+    缓存不早于SEGY文件且记录的道数、文件大小与当前文件一致时直接加载, 否则扫描道头并写入缓存
+    """
+    cache = filename + '.unique_coords.npz'
+    file_size = os.path.getsize(filename)
+    if os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(filename):
+        with np.load(cache) as coords:
+            # SEGY文件可能被保留了较早修改时间的副本替换, 缓存未记录道数和文件大小或与当前文件不符时重新扫描
+            if ('tracecount' in coords.files and coords['tracecount'] == segyfile.tracecount
+                    and coords['file_size'] == file_size):
+                return coords['sources'], coords['groups']
+
+    # 将道记录映射为结构化数组, 一次按步长取出整个文件的炮点和检波点坐标并去重
+    traces = trace_memmap(filename, segyfile, COORD_FIELDS, with_data=False)
+    unique_sources = unique_xy(traces['source_x'].astype(np.int32), traces['source_y'].astype(np.int32))
+    unique_groups = unique_xy(traces['group_x'].astype(np.int32), traces['group_y'].astype(np.int32))
+    del traces
+    try:
+        np.savez(cache, sources=unique_sources, groups=unique_groups,
+                 tracecount=segyfile.tracecount, file_size=file_size)
+    except OSError:
+        # 缓存写入失败不影响绘图
+        pass
+    return unique_sources, unique_groups
+
+def process_segy_file(filenames):
     # 访问非结构化数据
-    all_unique_source_coords = set()
-    all_unique_group_coords = set()
+    all_unique_source_coords = []
+    all_unique_group_coords = []
     
     for filename in filenames:
-        unique_source_coords = set()
-        unique_group_coords = set()
-        
         with segyio.open(filename, ignore_geometry=True) as segyfile:
             # 使用内存映射
             if segyfile.mmap():
@@ -39,21 +63,11 @@ def process_segy_file(filenames, batch_size=100000):
                 print(f"\nMemory mapping failed for {filename}!")
             
             num_traces = segyfile.tracecount
-            num_batches = (num_traces + batch_size - 1) // batch_size
             
-            for batch in tqdm(range(num_batches), desc="Processing Traces"):
-                start = batch * batch_size
-                end = min((batch + 1) * batch_size, num_traces)
-                
-                # 提取当前批次的炮点坐标并去重
-                sourceX = segyfile.attributes(segyio.TraceField.SourceX)[start:end]
-                sourceY = segyfile.attributes(segyio.TraceField.SourceY)[start:end]
-                unique_source_coords.update(set(zip(sourceX, sourceY)))
-                
-                # 提取当前批次的检波器坐标并去重
-                groupX = segyfile.attributes(segyio.TraceField.GroupX)[start:end]
-                groupY = segyfile.attributes(segyio.TraceField.GroupY)[start:end]
-                unique_group_coords.update(set(zip(groupX, groupY)))
+            # 炮点和检波器坐标去重
+            unique_sources, unique_groups = read_unique_coords(filename, segyfile)
+            all_unique_source_coords.append(unique_sources)
+            all_unique_group_coords.append(unique_groups)
             
             # 输出当前文件信息
             print(f"\n{filename} 统计信息:")
@@ -61,22 +75,20 @@ def process_segy_file(filenames, batch_size=100000):
             print("采样时间点数量:", len(segyfile.samples))
             print("每炮的地震道数量:", segyfile.header[-1][segyio.TraceField.TraceNumber])
             print("炮的数量:", num_traces / segyfile.header[-1][segyio.TraceField.TraceNumber])
-        
-        # 更新总的坐标集合
-        all_unique_source_coords.update(unique_source_coords)
-        all_unique_group_coords.update(unique_group_coords)
     
-    # 将所有文件的去重后的坐标转换为NumPy数组
-    sourceX, sourceY = np.array(list(all_unique_source_coords)).T
-    groupX, groupY = np.array(list(all_unique_group_coords)).T
+    # 合并所有文件的去重后的坐标并再次去重
+    all_source_coords = np.concatenate(all_unique_source_coords)
+    all_group_coords = np.concatenate(all_unique_group_coords)
+    sourceX, sourceY = unique_xy(all_source_coords[:, 0], all_source_coords[:, 1]).T
+    groupX, groupY = unique_xy(all_group_coords[:, 0], all_group_coords[:, 1]).T
     
     # 创建一个图形和轴对象
     fig, ax = plt.subplots(figsize=(16, 13))
     
-    # 绘制所有检波点
-    ax.scatter(groupX, groupY, color='blue', label='All Receivers', alpha=1)
+    # 绘制所有检波点(点集栅格化, 存为PDF/SVG等矢量格式时不逐点写出路径)
+    ax.scatter(groupX, groupY, color='blue', label='All Receivers', alpha=1, rasterized=True)
     # 绘制所有炮点
-    ax.scatter(sourceX, sourceY, color='green', label='All Sources', alpha=1)
+    ax.scatter(sourceX, sourceY, color='green', label='All Sources', alpha=1, rasterized=True)
     
     # 设置图形的标签和标题
     ax.set_xlabel('X Coordinate')